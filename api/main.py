@@ -2,41 +2,129 @@
 #### BACKEND             ###
 ############################
 
+import os
 import os.path as path
+import secrets
 import sys
+import time
 
+import numpy as np
 import pandas as pd
-from fastapi import FastAPI
-from fastapi.responses import HTMLResponse
+from botocore.exceptions import BotoCoreError, ClientError
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
-from torch import nn, tensor
 
 DIR_SCRIPT = path.dirname(path.abspath(__file__))
 sys.path.append(path.dirname(DIR_SCRIPT))
 
 from src.aws import AWSManager
-
-aws_manager = AWSManager()
-s3_bucket = "cyclingsimilarity-s3"
-
-UPDATE = aws_manager.load_data_from_s3(
-    bucket=s3_bucket, key="last_successful_train_run.txt"
-).decode("utf-8")
-EMBEDD = aws_manager.load_data_from_s3(
-    bucket=s3_bucket, key="learner.pkl", is_pickle=True
-)
-RIDERS = aws_manager.load_csv_as_pandas_from_s3(
-    bucket=s3_bucket, key="df_riders_data.csv"
-)
+from src.embeddings import compute_cosine_similarity, compute_row_norms
+from src.metrics import SIZE_BUCKETS, MetricsRegistry
+from src.model_format import read_model
+from src.profiler import SamplingProfiler
+
+# read the artifacts from a local folder instead of S3 (e.g. for benchmarks)
+LOCAL_ARTIFACTS_DIR = os.getenv("LOCAL_ARTIFACTS_DIR")
+
+ARTIFACTS = [
+    "last_successful_train_run.txt",
+    "rider_embeddings.tensors",  # rider factors stored as float32, float16 or int8
+    "df_riders_data.csv",
+]
+ARCHETYPES_FILE = "rider_archetypes.tensors"  # clusters and projections, optional
+
+if LOCAL_ARTIFACTS_DIR is None:
+    # download all artifacts at once into a cache that survives restarts
+    LOCAL_ARTIFACTS_DIR = os.getenv("S3_CACHE_DIR", path.join(DIR_SCRIPT, ".s3_cache"))
+    aws_manager = AWSManager()
+    try:
+        aws_manager.download_many_from_s3(
+            {key: path.join(LOCAL_ARTIFACTS_DIR, key) for key in ARTIFACTS},
+            bucket="cyclingsimilarity-s3",
+        )
+    except (BotoCoreError, ClientError):
+        if not all(path.exists(path.join(LOCAL_ARTIFACTS_DIR, k)) for k in ARTIFACTS):
+            raise
+        print("S3 can't be reached, serving the cached artifacts instead.")
+    try:
+        aws_manager.download_if_changed(
+            bucket="cyclingsimilarity-s3",
+            key=ARCHETYPES_FILE,
+            file=path.join(LOCAL_ARTIFACTS_DIR, ARCHETYPES_FILE),
+        )
+    except (BotoCoreError, ClientError):
+        print(f"{ARCHETYPES_FILE} can't be downloaded, using a cached one if any.")
+
+with open(path.join(LOCAL_ARTIFACTS_DIR, "last_successful_train_run.txt")) as f:
+    UPDATE = f.read()
+# memory-mapped and checked against their checksum, see src/model_format.py
+EMBEDD, _ = read_model(path.join(LOCAL_ARTIFACTS_DIR, "rider_embeddings.tensors"))
+RIDERS = pd.read_csv(path.join(LOCAL_ARTIFACTS_DIR, "df_riders_data.csv"))
 
 RIDERS["age"] = (
     (pd.to_datetime(UPDATE) - pd.to_datetime(RIDERS["birth_date"])).dt.days / 365.2425
 ).astype(int)
 RIDERS = RIDERS[
-    RIDERS["rider_name"].isin(EMBEDD.dls.classes["rider"])
+    RIDERS["rider_name"].isin(EMBEDD["names"])
 ]  # model is trained on fewer riders than in database
 RIDERS.drop(columns=["birth_date"], inplace=True)
 
+O2I = {name: i for i, name in enumerate(EMBEDD["names"])}
+NORMS = compute_row_norms(EMBEDD["values"])
+
+# archetypes only exist after a training run that clustered the riders
+ARCHET, ARCHET_O2I, ARCHETYPES, PROJECTIONS = None, {}, {}, {}
+eligible = set(RIDERS["rider_name"])
+if path.exists(path.join(LOCAL_ARTIFACTS_DIR, ARCHETYPES_FILE)):
+    ARCHET, _ = read_model(path.join(LOCAL_ARTIFACTS_DIR, ARCHETYPES_FILE))
+
+    # eligible cyclists per archetype, from most to least typical
+    ARCHET_O2I = {name: i for i, name in enumerate(ARCHET["names"])}
+    for i in np.lexsort((ARCHET["distances"], ARCHET["labels"])):
+        if ARCHET["names"][i] in eligible:
+            ARCHETYPES.setdefault(int(ARCHET["labels"][i]), []).append(
+                str(ARCHET["names"][i])
+            )
+    is_eligible = np.isin(ARCHET["names"], list(eligible))
+    PROJECTIONS = {
+        dims: dict(
+            zip(
+                ARCHET["names"][is_eligible].tolist(),
+                ARCHET["projection"][is_eligible, :dims].tolist(),
+            )
+        )
+        for dims in [2, 3]
+    }
+else:
+    print("Archetypes are not available until the next training run.")
+
+METRICS = MetricsRegistry()
+REQUEST_LATENCY = METRICS.histogram(
+    "api_request_duration_seconds", "Latency of API requests by endpoint."
+)
+PHASE_LATENCY = METRICS.histogram(
+    "api_similarity_phase_duration_seconds", "Latency of similarity request phases."
+)
+POPULATION_SIZE = METRICS.histogram(
+    "api_similarity_population_size",
+    "Number of cyclists left after filtering.",
+    buckets=SIZE_BUCKETS,
+)
+RESPONSE_SIZE = METRICS.histogram(
+    "api_response_size_bytes", "Size of API response payloads.", buckets=SIZE_BUCKETS
+)
+
+# opt-in, the profiler can then be started and stopped at runtime by token holders
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN")
+PROFILER = None
+if os.getenv("ENABLE_PROFILER") == "1":
+    if PROFILER_TOKEN:
+        PROFILER = SamplingProfiler()
+    else:
+        print("Profiler is not enabled, it needs a PROFILER_TOKEN.")
+
 
 def extract_most_similar_cyclists(
     cyclist: str, n: int, age_min: int, age_max: int, countries: list = None
@@ -48,26 +136,29 @@ def extract_most_similar_cyclists(
     if countries is None or len(countries) == 0:
         countries = RIDERS["nationality"].unique()
 
-    df_population = RIDERS[
-        (RIDERS["age"] >= age_min)
-        & (RIDERS["age"] <= age_max)
-        & (RIDERS["nationality"].isin(countries))
-    ].copy()
+    with PHASE_LATENCY.time(phase="filter"):
+        df_population = RIDERS[
+            (RIDERS["age"] >= age_min)
+            & (RIDERS["age"] <= age_max)
+            & (RIDERS["nationality"].isin(countries))
+        ].copy()
+
+    POPULATION_SIZE.observe(len(df_population))
 
     # compute similarity
-    idx_base = EMBEDD.dls.classes["rider"].o2i[cyclist]
-    idx_popu = tensor(
-        [EMBEDD.dls.classes["rider"].o2i[m] for m in df_population["rider_name"]]
-    )
-    factors = EMBEDD.model.u_weight.weight[idx_popu]
+    with PHASE_LATENCY.time(phase="similarity"):
+        idx_base = O2I[cyclist]
+        idx_popu = df_population["rider_name"].map(O2I).to_numpy()
 
-    simil = nn.CosineSimilarity(dim=1)(factors, EMBEDD.model.u_weight.weight[idx_base])
+        simil = compute_cosine_similarity(EMBEDD["values"], NORMS, idx_base, idx_popu)
 
-    # prepare output
-    df_population.loc[:, "similarity"] = simil.detach().numpy()
-    df_population.sort_values("similarity", ascending=False, inplace=True)
-    df_population.reset_index(drop=True, inplace=True)
-    df_population = df_population[~df_population["rider_name"].isin([cyclist, "#na#"])]
+        # prepare output
+        df_population.loc[:, "similarity"] = simil
+        df_population.sort_values("similarity", ascending=False, inplace=True)
+        df_population.reset_index(drop=True, inplace=True)
+        df_population = df_population[
+            ~df_population["rider_name"].isin([cyclist, "#na#"])
+        ]
 
     return df_population.iloc[:n,]
 
@@ -79,6 +170,27 @@ def extract_most_similar_cyclists(
 app = FastAPI(title="cyclingsimilarity.com API")
 
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+
+    route = request.scope.get("route")  # path template, e.g. not per cyclist
+    endpoint = route.path if route is not None else "unmatched"
+    REQUEST_LATENCY.observe(
+        time.perf_counter() - start,
+        method=request.method,
+        endpoint=endpoint,
+        status=response.status_code,
+    )
+    if "content-length" in response.headers:
+        RESPONSE_SIZE.observe(
+            int(response.headers["content-length"]), endpoint=endpoint
+        )
+
+    return response
+
+
 class Body(BaseModel):
     cyclist: str = "VAN AERT Wout"
     n: int = 10
@@ -113,6 +225,8 @@ def get_eligible_cyclists():
 @app.post("/list-similar-cyclists")
 def list_similar_cyclists(body: Body):
     """Lists the n most similar cyclists given base cyclist and filters."""
+    if body.cyclist not in O2I:
+        raise HTTPException(status_code=404, detail=f"Unknown cyclist {body.cyclist}.")
     res = extract_most_similar_cyclists(
         cyclist=body.cyclist,
         n=body.n,
@@ -121,12 +235,89 @@ def list_similar_cyclists(body: Body):
         countries=body.countries,
     )
 
-    out = dict(
-        zip(res["rider_name"], zip(res["nationality"], res["age"], res["similarity"]))
-    )
-    # out = res.set_index("rider_name").to_dict()
+    with PHASE_LATENCY.time(phase="serialization"):
+        out = dict(
+            zip(
+                res["rider_name"],
+                zip(res["nationality"], res["age"], res["similarity"]),
+            )
+        )
+        # out = res.set_index("rider_name").to_dict()
 
-    return {"cyclists": out}
+        # encode here rather than after returning, to include it in the timing
+        response = JSONResponse(jsonable_encoder({"cyclists": out}))
+
+    return response
+
+
+def check_archetypes():
+    if ARCHET is None:
+        raise HTTPException(status_code=503, detail="Archetypes are not available.")
+
+
+@app.get("/archetypes")
+def get_archetypes():
+    """Lists the cyclists per archetype, starting with the most typical ones."""
+    check_archetypes()
+    return {"archetypes": ARCHETYPES}
+
+
+@app.get("/archetypes/{cyclist}")
+def get_archetype_of_cyclist(cyclist: str):
+    """Returns the archetype of a cyclist and all cyclists of that archetype."""
+    check_archetypes()
+    if cyclist not in ARCHET_O2I or cyclist not in eligible:
+        raise HTTPException(status_code=404, detail=f"Unknown cyclist {cyclist}.")
+    archetype = int(ARCHET["labels"][ARCHET_O2I[cyclist]])
+
+    return {
+        "cyclist": cyclist,
+        "archetype": archetype,
+        "cyclists": ARCHETYPES.get(archetype, []),
+    }
+
+
+@app.get("/projection")
+def get_projection(dims: int = Query(2, ge=2, le=3)):
+    """Lists the 2D or 3D coordinates of all cyclists in the embedding space."""
+    check_archetypes()
+    return {
+        "explained_variance": ARCHET["explained_variance"][:dims].tolist(),
+        "cyclists": PROJECTIONS[dims],
+    }
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Exposes request metrics in the Prometheus text format."""
+    return PlainTextResponse(METRICS.render())
+
+
+def check_profiler_token(token):
+    """Stack traces expose the internals of the server, so only token holders get in."""
+    if PROFILER is None:
+        raise HTTPException(status_code=404, detail="Profiler is not enabled.")
+    if token is None or not secrets.compare_digest(token, PROFILER_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid profiler token.")
+
+
+@app.post("/profiler/start")
+def start_profiler(
+    interval_ms: int = Query(10, ge=1), x_profiler_token: str = Header(None)
+):
+    """Starts sampling the call stacks of the backend (if enabled)."""
+    check_profiler_token(x_profiler_token)
+    PROFILER.start(interval=interval_ms / 1000)
+
+    return {"running": True}
+
+
+@app.post("/profiler/stop")
+def stop_profiler(x_profiler_token: str = Header(None)):
+    """Stops the profiler and returns the sampled stacks in collapsed format."""
+    check_profiler_token(x_profiler_token)
+
+    return PlainTextResponse(PROFILER.stop())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+import os.path as path
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from fastapi.testclient import TestClient
+
+DIR_SCRIPT = path.dirname(path.abspath(__file__))
+sys.path.append(path.dirname(DIR_SCRIPT))
+
+from tests.synthetic import generate_artifacts, import_api
+
+############################
+############ CONFIG      ###
+############################
+
+SCALES = [1_000, 10_000, 100_000]
+N_VALUES = [5, 20, 100]
+
+# filters from wide to narrow, as passed in the body of a similarity request
+SELECTIVITIES = {
+    "none": {"age_min": 0, "age_max": 100, "countries": []},
+    "age": {"age_min": 22, "age_max": 35, "countries": []},
+    "age+country": {"age_min": 22, "age_max": 35, "countries": ["BE", "NL"]},
+    "narrow": {"age_min": 25, "age_max": 26, "countries": ["DK"]},
+}
+
+############################
+############ MEASURING   ###
+############################
+
+
+def summarize(latencies_ns):
+    """Latency percentiles in milliseconds."""
+    latencies_ms = np.asarray(latencies_ns) / 1e6
+    return {
+        "n_calls": len(latencies_ms),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "mean_ms": float(latencies_ms.mean()),
+    }
+
+
+def time_calls(fn, cyclists, n_repeats, n_warmup=3):
+    """Times fn on a rotating set of base cyclists, excluding a few warmup calls."""
+    for cyclist in cyclists[:n_warmup]:
+        fn(cyclist)
+
+    latencies = []
+    for i in range(n_repeats):
+        start = time.perf_counter_ns()
+        fn(cyclists[i % len(cyclists)])
+        latencies.append(time.perf_counter_ns() - start)
+
+    return latencies
+
+
+def measure_throughput(fn, cyclists, n_clients, duration_s):
+    """Calls per second completed by concurrent clients within a fixed time window."""
+    n_calls = [0] * n_clients
+    deadline = time.perf_counter() + duration_s
+
+    def run_client(i):
+        while time.perf_counter() < deadline:
+            fn(cyclists[(i + n_calls[i]) % len(cyclists)])
+            n_calls[i] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_clients) as executor:
+        list(executor.map(run_client, range(n_clients)))
+
+    return sum(n_calls) / (time.perf_counter() - start)
+
+
+def benchmark_scale(n_riders, dtype, n_repeats, n_clients=4, duration_s=1.0):
+    results = []
+    with tempfile.TemporaryDirectory() as dir_artifacts:
+        names = generate_artifacts(dir_artifacts, n_riders, dtype)
+        os.environ["LOCAL_ARTIFACTS_DIR"] = dir_artifacts  # read on import
+        api = import_api()
+        client = TestClient(api.app)
+
+        cyclists = list(np.random.default_rng(0).choice(names, size=50))
+        for selectivity, filters in SELECTIVITIES.items():
+            population = api.RIDERS[
+                (api.RIDERS["age"] >= filters["age_min"])
+                & (api.RIDERS["age"] <= filters["age_max"])
+                & (
+                    api.RIDERS["nationality"].isin(filters["countries"])
+                    if filters["countries"]
+                    else True
+                )
+            ]
+            for n in N_VALUES:
+                latencies_fn = time_calls(
+                    lambda c: api.extract_most_similar_cyclists(
+                        cyclist=c, n=n, **filters
+                    ),
+                    cyclists,
+                    n_repeats,
+                )
+
+                def call_app(c, n=n, filters=filters):
+                    client.post(
+                        "/list-similar-cyclists", json={"cyclist": c, "n": n, **filters}
+                    ).raise_for_status()
+
+                latencies_app = time_calls(call_app, cyclists, n_repeats)
+                throughput = measure_throughput(
+                    call_app, cyclists, n_clients, duration_s
+                )
+                case = {
+                    "n_riders": n_riders,
+                    "dtype": dtype,
+                    "selectivity": selectivity,
+                    "population": len(population),
+                    "n": n,
+                }
+                results.append(
+                    {**case, "target": "function", **summarize(latencies_fn)}
+                )
+                results.append(
+                    {
+                        **case,
+                        "target": "app",
+                        **summarize(latencies_app),
+                        "n_clients": n_clients,
+                        "throughput_per_s": throughput,
+                    }
+                )
+
+                print(
+                    f"{n_riders:>7} riders | {selectivity:<11} | n={n:<3} | "
+                    f"function p50 {results[-2]['p50_ms']:.2f} ms | "
+                    f"app p50 {results[-1]['p50_ms']:.2f} ms | "
+                    f"app {throughput:.0f} calls/s"
+                )
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the similarity API.")
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES)
+    parser.add_argument("--dtype", default="float32")
+    parser.add_argument("--repeats", type=int, default=100)
+    parser.add_argument(
+        "--clients", type=int, default=4, help="concurrent clients for throughput"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=1.0, help="seconds to measure throughput"
+    )
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    results = []
+    for n_riders in args.scales:
+        results += benchmark_scale(
+            n_riders, args.dtype, args.repeats, args.clients, args.duration
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "timestamp": pd.Timestamp.now().isoformat(),
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "pandas": pd.__version__,
+                "results": results,
+            },
+            f,
+            indent=4,
+        )
+
+    print(f"Benchmark results written to {args.output}")
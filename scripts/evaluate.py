@@ -0,0 +1,65 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+DIR_SCRIPT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(DIR_SCRIPT))
+
+from src.aws import AWSManager
+from src.evaluation import compare_models, load_model, read_holdout, to_model
+
+############################
+############ EVALUATION  ###
+############################
+
+
+def load(location):
+    """Loads a model from a local file or from S3, given as s3://bucket/key."""
+    if location.startswith("s3://"):
+        bucket, key = location[len("s3://") :].split("/", 1)
+        return to_model(*AWSManager().load_model_from_s3(bucket=bucket, key=key))
+    return load_model(location)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compares two trained models (model.tensors files) on held-out results."
+    )
+    parser.add_argument("model_a", help="path or s3:// uri of the reference model")
+    parser.add_argument("model_b", help="path or s3:// uri of the candidate model")
+    parser.add_argument(
+        "--holdout", help="path to a holdout.csv, skips rmse and recall if not given"
+    )
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument(
+        "--n-queries", type=int, default=2000, help="riders to compare neighbours of"
+    )
+    parser.add_argument("--n-workers", type=int, default=4)
+    parser.add_argument("--output", help="optional path to write the report as json")
+    args = parser.parse_args()
+
+    start = time.time()
+
+    report = compare_models(
+        load(args.model_a),
+        load(args.model_b),
+        df_holdout=read_holdout(args.holdout) if args.holdout else None,
+        k=args.k,
+        n_queries=args.n_queries,
+        n_workers=args.n_workers,
+    )
+
+    print(json.dumps(report, indent=4))
+    for name in ["a", "b"]:
+        if name in report and report[name]["rmse"] is None:
+            print(
+                f"No rmse for model {name}, the holdout results aren't normalized "
+                f"as {report[name]['normalize']}"
+            )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+
+    print(f"Script ran in {time.time() - start:.1f} seconds")
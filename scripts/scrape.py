@@ -1,22 +1,29 @@
+import argparse
+import csv
 import json
 import os.path as path
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
+from botocore.exceptions import ClientError
 from procyclingstats import Race, Stage
-from sklearn.feature_extraction import DictVectorizer
 
 DIR_SCRIPT = path.dirname(path.abspath(__file__))
 sys.path.append(path.dirname(DIR_SCRIPT))
 
-from src.aws import AWSManager
+from src.aws import AWSManager, serialize_pandas_as_csv
+from src.checkpoint import Checkpoint
+from src.instrumentation import PipelineMonitor
 from src.utils import (
+    RIDER_REGISTRY_COLUMNS,
     clean_rider_name,
-    convert_name_to_slug,
+    convert_names_to_slugs,
     parse_results_from_stage,
     parse_rider_info,
+    read_rider_registry,
     try_to_parse,
 )
 
@@ -28,132 +35,286 @@ RUN_DATE = pd.Timestamp.now().strftime("%Y-%m-%d")
 
 CONFIG = json.load(open(path.join(DIR_SCRIPT, "config.json")))["scrape"]
 
+DIR_WORK = path.join(path.dirname(DIR_SCRIPT), CONFIG["work_dir"])
+DIR_CHECKPOINT = path.join(DIR_WORK, "scrape_checkpoint")
+
+RESULTS_LONG_COLUMNS = ["year", "stage_slug", "class", "rider_name", "rank"]
+
+FILE_RESULTS_LONG = "df_race_results_long.csv"
+FILE_STAGES_DONE = "stages_done.txt"
+FILE_STAGES_FAILED = "stages_failed.txt"
+FILE_REGISTRY = "df_rider_registry.csv"  # kept across runs, unlike checkpoints
+
 ############################
 ############ SCRAPING    ###
 ############################
 
 
-def scrape(n_years):
-    aws_manager = AWSManager()
-    s3_bucket = "cyclingsimilarity-s3"
+def open_csv_sink(file, columns):
+    """Opens a csv file to append rows to, with a header if the file is new."""
+    is_new = not path.exists(file)
+    f = open(file, "a", newline="", encoding="utf-8")
+    writer = csv.writer(f)
+    if is_new:
+        writer.writerow(columns)
+    return f, writer
 
-    ###### scrape race results ######
 
-    df_races = aws_manager.load_csv_as_pandas_from_s3(
-        bucket=s3_bucket, key="df_races.csv"
-    )
+def scrape_race_overview(race_slug, year, run_date, monitor=None):
+    """Returns the stage slugs of a race in a given year, if it has finished."""
+    race_slug_full = f"race/{race_slug}/{year}/overview"
+    race_p = try_to_parse(Race, race_slug_full, monitor=monitor)
+    if race_p is None:
+        return []
 
-    years_to_scrape = [int(RUN_DATE[:4]) - i for i in range(n_years)][::-1]
-    print(f"Years to scrape: {years_to_scrape}")
+    # do not process if race end date is beyond dataset cutoff date
+    if race_p["enddate"] > run_date:
+        return []
 
-    df_races_out_list = []
-    for year in years_to_scrape:
-        races, classes, stages = [], [], []
-        for i, row in df_races.iterrows():
-            race_key, _, race_class, race_slug = row
-
-            race_slug_full = f"race/{race_slug}/{year}/overview"
-            race_p = try_to_parse(Race, race_slug_full)
-            if race_p is None:
-                continue
-            else:
-                # do not process if race end date is beyond dataset cutoff date
-                # but keep going, because races are not ordered chronologically
-                if race_p["enddate"] > RUN_DATE:
-                    continue
-
-                stage_slug_base = race_slug_full.replace(
-                    "/overview", ""
-                )  # has general classification if multi-stage race
-                if race_p["is_one_day_race"] is True:
-                    stage_slugs = [f"{stage_slug_base}/result"]  # one-day race
-                elif "stages" in race_p:
-                    stage_slugs = [f"{stage_slug_base}/gc"] + [
-                        f"{s['stage_url']}/result" for s in race_p["stages"]
-                    ]  # multiple stages
-
-                    races += [race_key] * len(stage_slugs)
-                    classes += [race_class] * len(stage_slugs)
-                    stages += stage_slugs
-
-        # note: 1.x = one-day race, 2.x = multi-day race & .UWT > .Pro > .1 > .2
-        df_races_out_list.append(
-            pd.DataFrame(
-                {"year": year, "race": races, "class": classes, "stage_slug": stages}
-            )
-        )
+    # one-day races are left out on purpose, as they always have been
+    if race_p["is_one_day_race"] is True or "stages" not in race_p:
+        return []
 
-    df_races_out = pd.concat(df_races_out_list)
+    stage_slug_base = race_slug_full.replace(
+        "/overview", ""
+    )  # has general classification if multi-stage race
+    return [f"{stage_slug_base}/gc"] + [
+        f"{s['stage_url']}/result" for s in race_p["stages"]
+    ]  # multiple stages
 
-    print("Race overviews are scraped, let's collect all results!")
 
-    df_races_out["parsed"] = df_races_out["stage_slug"].apply(
-        lambda x: try_to_parse(Stage, x)
-    )
+def collect_stages(year, race_keys, race_classes, stage_slugs):
+    """Collects the stage slugs of all races of a year in preallocated columns."""
+    n_stages = np.fromiter(map(len, stage_slugs), dtype=int, count=len(stage_slugs))
+    offsets = np.concatenate([[0], np.cumsum(n_stages)])
 
-    stages_not_parsed = df_races_out[df_races_out.parsed.isnull()][
-        "stage_slug"
-    ].tolist()
-    print(
-        f"{len(stages_not_parsed)} out of {len(df_races_out)} race results not parsed"
+    stages = np.empty(offsets[-1], dtype=object)
+    for slugs, lo, hi in zip(stage_slugs, offsets[:-1], offsets[1:]):
+        stages[lo:hi] = slugs
+
+    # note: 1.x = one-day race, 2.x = multi-day race & .UWT > .Pro > .1 > .2
+    return pd.DataFrame(
+        {
+            "year": np.full(offsets[-1], year),
+            "race": np.repeat(race_keys, n_stages),
+            "class": np.repeat(race_classes, n_stages),
+            "stage_slug": stages,
+        }
     )
 
-    df_races_out.dropna(
-        subset=["parsed"], inplace=True
-    )  # drop stages that couldn't be parsed
 
-    df_races_out["results"] = df_races_out[["stage_slug", "parsed"]].apply(
-        lambda x: parse_results_from_stage(*x), axis=1
+def stream_stage_results(df_races_out, monitor=None):
+    """Yields the compact results of each stage as soon as it is parsed.
+
+    The full parsed stage is dropped right away, a failed parse yields None.
+    """
+    for row in df_races_out.itertuples(index=False):
+        parsed = try_to_parse(Stage, row.stage_slug, monitor=monitor)
+        if parsed is None:
+            yield row, None
+        else:
+            yield row, parse_results_from_stage(row.stage_slug, parsed) or []
+
+
+def scrape(
+    n_years, monitor=None, resume=False, checkpoint_every=100, mirror=True, n_workers=8
+):
+    monitor = PipelineMonitor("scrape") if monitor is None else monitor
+    aws_manager = AWSManager(monitor=monitor)
+    s3_bucket = "cyclingsimilarity-s3"
+
+    checkpoint = Checkpoint(
+        DIR_CHECKPOINT,
+        aws_manager=aws_manager if mirror else None,
+        bucket=s3_bucket,
+        prefix="checkpoints/scrape",
     )
+    resumed = resume and checkpoint.restore()
+    if resumed:
+        print(f"Resuming scrape run of {checkpoint.state['run_date']}")
+    else:
+        checkpoint.reset(run_date=RUN_DATE, n_years=n_years)
+
+    run_date, n_years = checkpoint.state["run_date"], checkpoint.state["n_years"]
+    monitor.run_date = run_date
+
+    ###### scrape race results ######
+
+    with monitor.stage("load_races"):
+        df_races = aws_manager.load_csv_as_pandas_from_s3(
+            bucket=s3_bucket, key="df_races.csv"
+        )
+
+    years_to_scrape = [int(run_date[:4]) - i for i in range(n_years)][::-1]
+    print(f"Years to scrape: {years_to_scrape}")
+
+    with monitor.stage("race_overviews"):
+        years_todo = [
+            year
+            for year in years_to_scrape
+            if not checkpoint.is_done(f"race_overviews_{year}")
+        ]
+        race_keys, _, race_classes, race_slugs = (
+            df_races[c].to_numpy() for c in df_races.columns
+        )
+
+        # all (race, year) overviews are fetched concurrently, but years are
+        # collected and checkpointed in order as soon as all their races are in
+        executor = ThreadPoolExecutor(max_workers=n_workers)
+        try:
+            futures = {
+                year: [
+                    executor.submit(
+                        scrape_race_overview, race_slug, year, run_date, monitor
+                    )
+                    for race_slug in race_slugs
+                ]
+                for year in years_todo
+            }
+            for year, futures_year in futures.items():
+                stage_slugs = [future.result() for future in futures_year]
+                collect_stages(year, race_keys, race_classes, stage_slugs).to_csv(
+                    checkpoint.path(f"df_races_out_{year}.csv"), index=False
+                )
+                checkpoint.mark_done(
+                    f"race_overviews_{year}", f"df_races_out_{year}.csv"
+                )
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+        df_races_out = pd.concat(
+            [
+                pd.read_csv(checkpoint.path(f"df_races_out_{year}.csv"))
+                for year in years_to_scrape
+            ]
+        )
+
+    print("Race overviews are scraped, let's collect all results!")
 
-    vec = DictVectorizer()
-    results = df_races_out["results"].apply(lambda x: {} if x is None else dict(x))
-
-    df_results = pd.DataFrame(
-        vec.fit_transform(results).toarray(),
-        columns=vec.get_feature_names_out(),
-        # set year, stage slug, and class as indices
-        index=pd.MultiIndex.from_frame(
-            pd.concat(
-                [
-                    df_races_out["year"],
-                    df_races_out["stage_slug"].str.replace("race/", ""),
-                    df_races_out["class"],
-                ],
-                axis=1,
+    with monitor.stage("stage_results"):
+        files = (FILE_RESULTS_LONG, FILE_STAGES_DONE, FILE_STAGES_FAILED)
+        if not checkpoint.is_done("stage_results"):
+            stages_done = checkpoint.read_units(FILE_STAGES_DONE)
+            df_todo = df_races_out[~df_races_out["stage_slug"].isin(stages_done)]
+
+            f, writer = open_csv_sink(
+                checkpoint.path(FILE_RESULTS_LONG), RESULTS_LONG_COLUMNS
             )
-        ),
-    )
+            f_done = open(checkpoint.path(FILE_STAGES_DONE), "a", encoding="utf-8")
+            f_failed = open(checkpoint.path(FILE_STAGES_FAILED), "a", encoding="utf-8")
+            with f, f_done, f_failed:
+                for i, (row, results) in enumerate(
+                    stream_stage_results(df_todo, monitor), start=1
+                ):
+                    year, _, race_class, stage_slug = row
+                    if results is None:
+                        f_failed.write(f"{stage_slug}\n")
+                    else:
+                        writer.writerows(
+                            (
+                                year,
+                                stage_slug.replace("race/", ""),
+                                race_class,
+                                clean_rider_name(name.strip()),
+                                rank,
+                            )
+                            for name, rank in results
+                        )
+                    f_done.write(f"{stage_slug}\n")
+                    for f_ in (f, f_done, f_failed):
+                        f_.flush()  # keeps partial progress on disk
+
+                    if i % checkpoint_every == 0:
+                        checkpoint.sync(*files)
+
+            checkpoint.mark_done("stage_results", *files)
+
+        n_not_parsed = len(checkpoint.read_units(FILE_STAGES_FAILED))
+        print(f"{n_not_parsed} out of {len(df_races_out)} race results not parsed")
+
+    with monitor.stage("vectorization"):
+        df_results_long = pd.read_csv(
+            checkpoint.path(FILE_RESULTS_LONG), encoding="utf-8"
+        )
 
-    df_results.replace(
-        0, np.nan, inplace=True
-    )  # drops distinction between NaN = did not finish and 0 = did not participate
+        df_results = df_results_long.drop_duplicates(
+            subset=["year", "stage_slug", "class", "rider_name"], keep="last"
+        ).pivot(
+            index=["year", "stage_slug", "class"], columns="rider_name", values="rank"
+        )  # set year, stage slug, and class as indices
+        df_results.columns.name = None
 
-    df_results = df_results.dropna(
-        axis=0, how="all"
-    )  # drop results that couldn't be parsed
+        df_results.replace(
+            0, np.nan, inplace=True
+        )  # drops distinction between NaN = did not finish and 0 = did not participate
 
-    df_results.columns = [clean_rider_name(c) for c in df_results.columns.str.strip()]
+        df_results = df_results.dropna(
+            axis=0, how="all"
+        )  # drop results that couldn't be parsed
 
     ###### scrape riders data ######
 
     print("Time to scrape some rider metadata!")
 
-    riders_all = sorted(df_results.columns)
-    df_riders = pd.DataFrame(
-        {
-            "rider_name": riders_all,
-            "rider_slug": [convert_name_to_slug(r) for r in riders_all],
-        }
-    )
-    df_riders[["nationality", "birth_date"]] = (
-        df_riders["rider_slug"].apply(parse_rider_info).tolist()
-    )
-    df_riders.drop(columns=["rider_slug"], inplace=True)
-
-    n_riders_not_parsed = df_riders.nationality.isnull().sum()
-    print(f"{n_riders_not_parsed} out of {len(df_riders)} riders' metadata not parsed")
-    df_riders.dropna(inplace=True)
+    with monitor.stage("rider_metadata"):
+        df_riders = pd.DataFrame({"rider_name": sorted(df_results.columns)})
+        df_riders["rider_slug"] = convert_names_to_slugs(df_riders["rider_name"])
+
+        path_registry = path.join(DIR_WORK, FILE_REGISTRY)
+        if not checkpoint.is_done("rider_metadata"):
+            # the registry on S3 is leading, unless this run already extended it
+            if mirror and not (resumed and path.exists(path_registry)):
+                try:
+                    aws_manager.load_file_from_s3(
+                        bucket=s3_bucket, key=FILE_REGISTRY, file=path_registry
+                    )
+                except ClientError:
+                    print("No rider registry on S3 yet, starting a new one.")
+
+            df_new = df_riders
+            if path.exists(path_registry):
+                df_known = read_rider_registry(path_registry).dropna(
+                    subset=["nationality", "birth_date"]
+                )  # failed fetches are retried
+                df_new = df_riders.merge(
+                    df_known[["rider_name", "rider_slug"]],
+                    how="left",
+                    indicator=True,
+                ).query(
+                    "_merge == 'left_only'"
+                )  # slug changes are fetched again
+            print(f"{len(df_new)} out of {len(df_riders)} riders new to the registry")
+
+            f, writer = open_csv_sink(path_registry, RIDER_REGISTRY_COLUMNS)
+            with f:
+                for i, (rider, rider_slug) in enumerate(
+                    zip(df_new["rider_name"], df_new["rider_slug"]), start=1
+                ):
+                    writer.writerow(
+                        (rider, rider_slug, *parse_rider_info(rider_slug, monitor))
+                    )
+                    f.flush()
+
+                    if mirror and i % checkpoint_every == 0:
+                        aws_manager.store_data_from_file_to_s3(
+                            path_registry, bucket=s3_bucket, key=FILE_REGISTRY
+                        )
+
+            if mirror:
+                aws_manager.store_data_from_file_to_s3(
+                    path_registry, bucket=s3_bucket, key=FILE_REGISTRY
+                )
+            checkpoint.mark_done("rider_metadata")
+
+        df_riders = df_riders.merge(
+            read_rider_registry(path_registry), on=["rider_name", "rider_slug"]
+        ).drop(columns=["rider_slug"])
+
+        n_riders_not_parsed = df_riders.nationality.isnull().sum()
+        print(
+            f"{n_riders_not_parsed} out of {len(df_riders)} riders' metadata not parsed"
+        )
+        df_riders.dropna(inplace=True)
 
     ###### coordinate datasets ######
 
@@ -166,18 +327,44 @@ def scrape(n_years):
 
     ###### store output to AWS ######
 
-    aws_manager.store_pandas_as_csv_to_s3(
-        df_riders, bucket=s3_bucket, key="df_riders_data.csv"
-    )
-    aws_manager.store_pandas_as_csv_to_s3(
-        df_results, bucket=s3_bucket, key="df_race_results.csv", index=True
+    with monitor.stage("s3_upload"):
+        aws_manager.store_many_to_s3(
+            {
+                "df_riders_data.csv": serialize_pandas_as_csv(df_riders),
+                "df_race_results.csv": serialize_pandas_as_csv(df_results, index=True),
+            },
+            bucket=s3_bucket,
+        )
+        checkpoint.finish()  # a next --resume starts a new run
+
+    aws_manager.store_data_from_string_to_s3(
+        monitor.to_json(), bucket=s3_bucket, key=f"metrics/scrape_{run_date}.json"
     )
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrapes race results from PCS.")
+    parser.add_argument(
+        "--resume", action="store_true", help="continue from the last checkpoint"
+    )
+    args = parser.parse_args()
+
     start = time.time()
 
     print(f"***Running scrape.py script in directory {DIR_SCRIPT} on {RUN_DATE}***")
-    scrape(n_years=CONFIG["n_years"])
+    monitor = PipelineMonitor("scrape", run_date=RUN_DATE)
+    try:
+        scrape(
+            n_years=CONFIG["n_years"],
+            monitor=monitor,
+            resume=args.resume,
+            checkpoint_every=CONFIG["checkpoint_every"],
+            mirror=CONFIG["checkpoint_to_s3"],
+            n_workers=CONFIG["n_workers"],
+        )
+    finally:
+        monitor.print_summary()
+        with open(path.join(DIR_SCRIPT, "metrics_scrape.json"), "w") as f:
+            f.write(monitor.to_json())
 
     print(f"Script ran in {time.time() - start:.0f} seconds")  # c. 30 minutes
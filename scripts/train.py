@@ -1,24 +1,31 @@
+import argparse
 import json
 import os
+import shutil
 import sys
 import time
 
+import numpy as np
 import pandas as pd
-from fastai.collab import CollabDataLoaders, collab_learner
+from fastai.collab import EmbeddingDotBias
+from fastai.learner import Learner
+from fastai.losses import MSELossFlat
 from fastai.tabular.all import valley
 
 DIR_SCRIPT = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.dirname(DIR_SCRIPT))
 
 from src.aws import AWSManager
-from src.utils import (
-    get_gc_weight,
-    get_race_class_weight,
-    get_stage_weight,
-    get_y_range,
-    get_year_weight,
-    normalize_results_by_race,
+from src.clustering import build_archetypes
+from src.embeddings import (
+    build_embeddings_report,
+    export_embeddings,
+    select_embedding_dtype,
 )
+from src.instrumentation import PipelineMonitor
+from src.model_format import serialize_model, write_model
+from src.ratings import HOLDOUT_FILE, prepare_ratings
+from src.utils import extract_factors, extract_model, get_y_range
 
 ############################
 ############ CONFIG      ###
@@ -28,103 +35,185 @@ RUN_DATE = pd.Timestamp.now().strftime("%Y-%m-%d")
 
 CONFIG = json.load(open(os.path.join(DIR_SCRIPT, "config.json")))["train"]
 
+DIR_WORK = os.path.join(os.path.dirname(DIR_SCRIPT), CONFIG["work_dir"])
+
+MODEL_FILE = "model.tensors"  # all weights, see src/model_format.py
+
 ############################
 ############ TRAINING    ###
 ############################
 
 
-def train(n_factors, n_epochs, n_participations, normalize):
-    aws_manager = AWSManager()
+def train(
+    n_factors,
+    n_epochs,
+    n_participations,
+    normalize,
+    embedding_dtype="float32",
+    min_topk_overlap=0.95,
+    chunksize=500,
+    n_clusters=8,
+    holdout_frac=0.0,
+    monitor=None,
+):
+    """Trains the embeddings and publishes all artifacts to S3.
+
+    With a holdout fraction, the run is an experiment instead: the model is stored
+    locally next to the held-out results for scripts/evaluate.py, nothing is
+    published.
+    """
+    monitor = (
+        PipelineMonitor("train", run_date=RUN_DATE) if monitor is None else monitor
+    )
+    aws_manager = AWSManager(monitor=monitor)
     s3_bucket = "cyclingsimilarity-s3"
 
     ###### train embeddings ######
 
-    df_results = aws_manager.load_csv_as_pandas_from_s3(
-        bucket=s3_bucket,
-        key="df_race_results.csv",
-        # kwargs
-        index_col=[0, 1, 2],
-        dtype={"year": str, "stage_slug": str, "class": str},
-    )
-
-    df_results = df_results[
-        df_results.columns[df_results.count(axis=0) >= n_participations]
-    ]
-    df_results = normalize_results_by_race(df_results, how=normalize)
-    df_results = df_results.astype(float)
-
-    df_reweight = df_results.index.to_frame().reset_index(drop=True)
-    df_reweight["w_year"] = (
-        df_reweight["year"]
-        .astype(int)
-        .apply(get_year_weight, curr_year=int(RUN_DATE[:4]))
-    )
-    df_reweight["w_class"] = (
-        df_reweight["class"].str.partition(".")[2].apply(get_race_class_weight)
-    )
-    df_reweight["w_stage"] = (
-        df_reweight["stage_slug"].str.contains("/stage-").apply(get_stage_weight)
-    )
-    df_reweight["w_gc"] = (
-        df_reweight["stage_slug"].str.contains("/gc").apply(get_gc_weight)
-    )
-    df_reweight["w"] = (
-        df_reweight["w_year"]
-        * df_reweight["w_class"]
-        * df_reweight["w_stage"]
-        * df_reweight["w_gc"]
-    )
-
-    df_reweight.set_index(["year", "stage_slug", "class"], inplace=True)
-
-    df_results.loc[:, :] = (
-        df_results.to_numpy() * df_reweight[["w"]].to_numpy()
-    )  # scale race results by weights
-
-    df = pd.melt(
-        df_results.reset_index(drop=False).drop(columns=["year", "class"]),
-        id_vars="stage_slug",
-    )
-    df.rename(
-        columns={"stage_slug": "stage", "variable": "rider", "value": "result"},
-        inplace=True,
-    )
-    df = df[
-        ["rider", "stage", "result"]
-    ].dropna()  # rider = user, stage (race) = item, result = rating
+    path_results = os.path.join(DIR_WORK, "df_race_results.csv")
+    dir_ratings = os.path.join(DIR_WORK, "ratings")
+
+    with monitor.stage("load_results"):
+        os.makedirs(DIR_WORK, exist_ok=True)
+        aws_manager.download_if_changed(
+            bucket=s3_bucket, key="df_race_results.csv", file=path_results
+        )  # streamed to disk, not into memory, and skipped if unchanged
+
+    with monitor.stage("preparation"):
+        ratings = prepare_ratings(
+            path_results,
+            dir_ratings,
+            n_participations=n_participations,
+            normalize=normalize,
+            curr_year=int(RUN_DATE[:4]),
+            chunksize=chunksize,
+            holdout_frac=holdout_frac,
+        )  # rider = user, stage (race) = item, result = rating
 
     print(
-        f"Training dataset has {df.rider.nunique()} riders, {df.stage.nunique()} races"
+        f"Training dataset has {len(ratings)} results of "
+        f"{len(ratings.classes['rider']) - 1} riders, "
+        f"{len(np.unique(ratings.stage))} races"
     )
 
-    dls = CollabDataLoaders.from_df(df, bs=64)
-
-    y_range = get_y_range(how=normalize)
-    learn = collab_learner(dls, n_factors=n_factors, y_range=y_range)
-    lrs = learn.lr_find(suggest_funcs=(valley))
-    os.rmdir(os.path.join(os.getcwd(), "models"))
-    learn.fit_one_cycle(n_epochs, lrs.valley, wd=0.1)
+    with monitor.stage("fitting"):
+        dls = ratings.dataloaders(bs=64)
+
+        y_range = get_y_range(how=normalize)
+        model = EmbeddingDotBias.from_classes(n_factors, dls.classes, y_range=y_range)
+        learn = Learner(dls, model, loss_func=MSELossFlat())
+        lrs = learn.lr_find(suggest_funcs=(valley))
+        os.rmdir(os.path.join(os.getcwd(), "models"))
+        learn.fit_one_cycle(n_epochs, lrs.valley, wd=0.1)
+
+    tensors, metadata = extract_model(learn, normalize=normalize)
+    metadata["run_date"] = RUN_DATE
+
+    if holdout_frac > 0:
+        dir_eval = os.path.join(
+            DIR_WORK, "evaluation", f"{RUN_DATE}_{normalize}_{n_factors}"
+        )
+        os.makedirs(dir_eval, exist_ok=True)
+        write_model(os.path.join(dir_eval, MODEL_FILE), tensors, metadata)
+        shutil.copy(os.path.join(dir_ratings, HOLDOUT_FILE), dir_eval)
+        print(f"Model and holdout for evaluation are stored in {dir_eval}")
+        return
+
+    ###### export embeddings ######
+
+    with monitor.stage("embeddings_export"):
+        factors = extract_factors(learn, dim="rider").detach().cpu().numpy()
+
+        report = build_embeddings_report(factors)
+        for dtype, stats in report.items():
+            print(
+                f"Embeddings as {dtype}: {stats['n_bytes']} bytes, "
+                f"top-k overlap with float32 of {stats['topk_overlap']:.3f}"
+            )
+
+        if embedding_dtype == "auto":
+            embedding_dtype = select_embedding_dtype(report, min_topk_overlap)
+        elif report[embedding_dtype]["topk_overlap"] < min_topk_overlap:
+            print(
+                f"Embeddings as {embedding_dtype} alter rankings, using float32 instead"
+            )
+            embedding_dtype = "float32"
+        print(f"Rider embeddings are exported as {embedding_dtype}")
+
+        embeddings = export_embeddings(
+            names=list(learn.dls.classes["rider"]),
+            factors=factors,
+            dtype=embedding_dtype,
+        )
+
+    ###### cluster riders into archetypes ######
+
+    with monitor.stage("clustering"):
+        names = list(learn.dls.classes["rider"])
+        archetypes = build_archetypes(
+            names[1:], factors[1:], n_clusters=n_clusters
+        )  # skip '#na#' placeholder
 
     ###### store output to AWS ######
 
-    aws_manager.store_pickle_to_s3(
-        obj=learn, bucket=s3_bucket, key="learner.pkl"
-    )  # partly mimicks learn.export()
+    with monitor.stage("s3_upload"):
+        aws_manager.store_many_to_s3(
+            {
+                MODEL_FILE: serialize_model(tensors, metadata),  # no pickle
+                "rider_embeddings.tensors": serialize_model(
+                    embeddings, {"dtype": embedding_dtype, "run_date": RUN_DATE}
+                ),  # versioned and checksummed, like the model
+                "rider_archetypes.tensors": serialize_model(
+                    archetypes, {"run_date": RUN_DATE}
+                ),
+                "rider_embeddings_report.json": json.dumps(
+                    {"dtype": embedding_dtype, "report": report}, indent=4
+                ),
+            },
+            bucket=s3_bucket,
+        )  # in parallel, bounded by the largest object
+
+        aws_manager.store_data_from_string_to_s3(
+            RUN_DATE, bucket=s3_bucket, key="last_successful_train_run.txt"
+        )  # only once all artifacts are stored
 
     aws_manager.store_data_from_string_to_s3(
-        RUN_DATE, bucket=s3_bucket, key="last_successful_train_run.txt"
+        monitor.to_json(), bucket=s3_bucket, key=f"metrics/train_{RUN_DATE}.json"
     )
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trains the rider embeddings.")
+    parser.add_argument(
+        "--holdout-frac",
+        type=float,
+        default=0.0,
+        help="hold out this share of the most recent year and store for evaluation",
+    )
+    parser.add_argument("--normalize", default=CONFIG["normalize"])
+    parser.add_argument("--n-factors", type=int, default=CONFIG["n_factors"])
+    args = parser.parse_args()
+
     start = time.time()
 
     print(f"***Running train.py script in directory {DIR_SCRIPT} on {RUN_DATE}***")
-    train(
-        n_factors=CONFIG["n_factors"],
-        n_epochs=CONFIG["n_epochs"],
-        n_participations=CONFIG["n_participations"],
-        normalize=CONFIG["normalize"],
-    )
+    monitor = PipelineMonitor("train", run_date=RUN_DATE)
+    try:
+        train(
+            n_factors=args.n_factors,
+            n_epochs=CONFIG["n_epochs"],
+            n_participations=CONFIG["n_participations"],
+            normalize=args.normalize,
+            embedding_dtype=CONFIG["embedding_dtype"],
+            min_topk_overlap=CONFIG["min_topk_overlap"],
+            chunksize=CONFIG["chunksize"],
+            n_clusters=CONFIG["n_clusters"],
+            holdout_frac=args.holdout_frac,
+            monitor=monitor,
+        )
+    finally:
+        monitor.print_summary()
+        with open(os.path.join(DIR_SCRIPT, "metrics_train.json"), "w") as f:
+            f.write(monitor.to_json())
 
     print(f"Script ran in {time.time() - start:.0f} seconds")  # c. 3-4 minutes
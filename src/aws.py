@@ -1,18 +1,25 @@
 import io
 import os
-import pathlib
-import pickle
-from platform import system
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 import pandas as pd
+from botocore.exceptions import ClientError
 from dotenv import load_dotenv
-from fastai.collab import load_learner
+
+from src.instrumentation import PipelineMonitor
+from src.model_format import deserialize_model
 
 
 class AWSManager:
-    def __init__(self):
+    def __init__(self, monitor=None):
         self.session = AWSManager.authenticate_to_aws()
+        self.monitor = PipelineMonitor("aws") if monitor is None else monitor
+        self.endpoint_url = os.getenv("AWS_ENDPOINT_URL")  # e.g. a local S3 stand-in
+        self.s3 = self.session.client(
+            "s3", endpoint_url=self.endpoint_url
+        )  # one thread-safe client shared by all methods and threads
         print("Successfully authenticated to AWS.")
 
     @staticmethod
@@ -35,8 +42,7 @@ class AWSManager:
 
     def list_s3_buckets(self):
         """Lists all S3 buckets in account."""
-        s3 = self.session.client("s3")
-        response = s3.list_buckets()
+        response = self.s3.list_buckets()
         buckets = [bucket["Name"] for bucket in response["Buckets"]]
 
         return buckets
@@ -47,80 +53,123 @@ class AWSManager:
 
     def store_data_from_file_to_s3(self, file, bucket, key):
         """Stores data from a file to specified S3 bucket."""
-        s3 = self.session.client("s3")
-        s3.upload_file(Bucket=bucket, Key=key, Filename=file)
+        with self.monitor.request("s3"):
+            self.s3.upload_file(Bucket=bucket, Key=key, Filename=file)
+
+        self.monitor.count("s3_bytes", os.path.getsize(file))
 
     def store_data_from_string_to_s3(self, string, bucket, key):
         """Stores a string or text file to specified S3 bucket."""
-        s3 = self.session.client("s3")
-        response = s3.put_object(Bucket=bucket, Key=key, Body=string)
-
-        AWSManager.get_status(response)
-
-    def store_pickle_to_s3(self, obj, bucket, key):
-        """Stores an object as a pickle file to specified S3 bucket."""
-        s3 = self.session.client("s3")
-        with io.BytesIO() as buffer:
-            pickle.dump(obj, buffer)
-            buffer.seek(0)
-
-            response = s3.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+        body = string.encode("utf-8") if isinstance(string, str) else string
+        with self.monitor.request("s3"):
+            response = self.s3.put_object(Bucket=bucket, Key=key, Body=body)
 
+        self.monitor.count("s3_bytes", len(body))
         AWSManager.get_status(response)
 
     def store_pandas_as_csv_to_s3(self, df, bucket, key, index=False):
         """Stores a pandas DataFrame as a csv file to specified S3 bucket."""
-        s3 = self.session.client("s3")
-        with io.StringIO() as buffer:
-            df.to_csv(buffer, index=index)
+        body = serialize_pandas_as_csv(df, index=index)
 
-            response = s3.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+        with self.monitor.request("s3"):
+            response = self.s3.put_object(Bucket=bucket, Key=key, Body=body)
 
+        self.monitor.count("s3_bytes", len(body))
         AWSManager.get_status(response)
 
+    def store_many_to_s3(self, bodies, bucket, n_workers=8):
+        """Stores a dictionary of keys and strings or bytes to S3 in parallel."""
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = [
+                executor.submit(self.store_data_from_string_to_s3, body, bucket, key)
+                for key, body in bodies.items()
+            ]
+        for future in futures:
+            future.result()  # raises the first error, if any
+
     #####################
     ##### RETRIEVAL   ###
     #####################
 
-    def load_data_from_s3(self, bucket, key, is_pickle=False):
+    def load_file_from_s3(self, bucket, key, file):
+        """Downloads a key from specified S3 bucket to a local file."""
+        with self.monitor.request("s3"):
+            self.s3.download_file(Bucket=bucket, Key=key, Filename=file)
+
+        self.monitor.count("s3_bytes", os.path.getsize(file))
+
+    def download_if_changed(self, bucket, key, file):
+        """Downloads a key to a local file, unless the file already has that version.
+
+        The ETag of every download is kept next to the file and sent along with the
+        next request, so that S3 only returns the object if it changed since.
+        """
+        file_etag = f"{file}.etag"
+        kwargs = {}
+        if os.path.exists(file) and os.path.exists(file_etag):
+            with open(file_etag) as f:
+                kwargs["IfNoneMatch"] = f.read()
+
+        with self.monitor.request("s3"):
+            try:
+                response = self.s3.get_object(Bucket=bucket, Key=key, **kwargs)
+            except ClientError as e:
+                if e.response["ResponseMetadata"].get("HTTPStatusCode") != 304:
+                    raise
+                self.monitor.count("s3_cache_hits")
+                return file
+
+            os.makedirs(os.path.dirname(os.path.abspath(file)), exist_ok=True)
+            with open(f"{file}.part", "wb") as f:
+                shutil.copyfileobj(response["Body"], f, length=1024**2)
+            os.replace(f"{file}.part", file)  # never leave a half-written file
+            with open(file_etag, "w") as f:
+                f.write(response["ETag"])
+
+        self.monitor.count("s3_bytes", response.get("ContentLength", 0))
+        return file
+
+    def download_many_from_s3(self, files, bucket, n_workers=8):
+        """Downloads a dictionary of keys and local files from S3 in parallel.
+
+        Files that are still up to date are not downloaded again.
+        """
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = {
+                key: executor.submit(self.download_if_changed, bucket, key, file)
+                for key, file in files.items()
+            }
+        return {key: future.result() for key, future in futures.items()}
+
+    def load_data_from_s3(self, bucket, key):
         """Loads data key from specified S3 bucket."""
-        s3 = self.session.client("s3")
-        response = s3.get_object(Bucket=bucket, Key=key)
+        with self.monitor.request("s3"):
+            response = self.s3.get_object(Bucket=bucket, Key=key)
 
+        self.monitor.count("s3_bytes", response.get("ContentLength", 0))
         AWSManager.get_status(response)
 
-        # this is a bit tricky in case the request failed
-        if is_pickle:
-            if system() == "Linux":
-                pathlib.WindowsPath = pathlib.PosixPath
-            obj = pickle.loads(response.get("Body").read())
-        else:
-            obj = response.get("Body").read()
-
-        return obj
+        return response.get("Body").read()
 
     def load_csv_as_pandas_from_s3(self, bucket, key, **kwargs):
         """Loads a csv file from specified S3 bucket into a pandas DataFrame."""
-        s3 = self.session.client("s3")
-        response = s3.get_object(Bucket=bucket, Key=key)
-        df = pd.read_csv(response.get("Body"), **kwargs)
+        with self.monitor.request("s3"):
+            response = self.s3.get_object(Bucket=bucket, Key=key)
+            df = pd.read_csv(response.get("Body"), **kwargs)
 
+        self.monitor.count("s3_bytes", response.get("ContentLength", 0))
         AWSManager.get_status(response)
 
         return df
 
-    def load_learner_from_s3(self, bucket, key):
-        """Loads a fastai learner from specified S3 bucket."""
-        s3 = self.session.resource("s3")
-        with io.BytesIO() as data:
-            s3.Bucket(bucket).download_fileobj(key, data)
-            data.seek(
-                0
-            )  # move back to the beginning after writing (not to disk though)
-            if system() == "Linux":
-                pathlib.WindowsPath = pathlib.PosixPath
-            learn = load_learner(
-                data
-            )  # only works if first stored via learn.export(), not plain pickle
-
-        return learn
+    def load_model_from_s3(self, bucket, key, verify=True):
+        """Loads tensors and metadata in the model format from specified S3 bucket."""
+        return deserialize_model(
+            self.load_data_from_s3(bucket, key), verify=verify
+        )  # tensors are views on the downloaded bytes
+
+
+def serialize_pandas_as_csv(df, index=False):
+    with io.StringIO() as buffer:
+        df.to_csv(buffer, index=index)
+        return buffer.getvalue().encode("utf-8")
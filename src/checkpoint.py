@@ -0,0 +1,104 @@
+import json
+import os
+import os.path as path
+import shutil
+
+from botocore.exceptions import ClientError
+
+
+class Checkpoint:
+    """Tracks completed units of work of a pipeline run in a local folder.
+
+    The folder holds a state file with the completed phases and any number of
+    files with intermediate output. It can be mirrored to S3, so that a run can
+    also be resumed on another machine.
+    """
+
+    STATE_FILE = "checkpoint.json"
+
+    def __init__(self, dir_checkpoint, aws_manager=None, bucket=None, prefix=None):
+        self.dir = dir_checkpoint
+        self.aws_manager = aws_manager
+        self.bucket = bucket
+        self.prefix = prefix
+        self.state = {}
+
+    def path(self, name):
+        return path.join(self.dir, name)
+
+    def reset(self, **state):
+        """Starts a fresh run, throwing away any previous progress (also on S3)."""
+        shutil.rmtree(self.dir, ignore_errors=True)
+        os.makedirs(self.dir)
+        self.state = {**state, "phases_done": [], "files": [], "finished": False}
+        self.sync()  # so that no other machine can resume the previous run
+
+    def restore(self):
+        """Loads the state of an unfinished previous run, from S3 if not local."""
+        if not path.exists(self.path(Checkpoint.STATE_FILE)) and self.is_mirrored:
+            os.makedirs(self.dir, exist_ok=True)
+            try:
+                self._download(Checkpoint.STATE_FILE)
+            except ClientError:  # no previous run to resume
+                return False
+            with open(self.path(Checkpoint.STATE_FILE)) as f:
+                state = json.load(f)
+            if not state.get("finished"):
+                self.aws_manager.download_many_from_s3(
+                    {
+                        f"{self.prefix}/{name}": self.path(name)
+                        for name in state["files"]
+                    },
+                    bucket=self.bucket,
+                )
+
+        if not path.exists(self.path(Checkpoint.STATE_FILE)):
+            return False
+
+        with open(self.path(Checkpoint.STATE_FILE)) as f:
+            self.state = json.load(f)
+
+        return not self.state.get("finished", False)
+
+    def save(self):
+        with open(self.path(Checkpoint.STATE_FILE), "w") as f:
+            json.dump(self.state, f, indent=4)
+
+    def is_done(self, phase):
+        return phase in self.state["phases_done"]
+
+    def mark_done(self, phase, *names):
+        """Marks a phase as completed and mirrors its output files."""
+        self.state["phases_done"].append(phase)
+        self.sync(*names)
+
+    def sync(self, *names):
+        """Saves the state and uploads it with the given files if mirrored to S3."""
+        self.state["files"] = sorted(set(self.state["files"]) | set(names))
+        self.save()
+        if self.is_mirrored:
+            for name in names + (Checkpoint.STATE_FILE,):
+                self.aws_manager.store_data_from_file_to_s3(
+                    self.path(name), bucket=self.bucket, key=f"{self.prefix}/{name}"
+                )
+
+    def finish(self):
+        """Marks the run as completed, so that it is not resumed anymore."""
+        self.state["finished"] = True
+        self.sync()
+
+    def read_units(self, name):
+        """Reads the units of work (one per line) listed in a checkpoint file."""
+        if not path.exists(self.path(name)):
+            return set()
+        with open(self.path(name), encoding="utf-8") as f:
+            return {line.rstrip("\n") for line in f}
+
+    @property
+    def is_mirrored(self):
+        return self.aws_manager is not None
+
+    def _download(self, name):
+        self.aws_manager.load_file_from_s3(
+            bucket=self.bucket, key=f"{self.prefix}/{name}", file=self.path(name)
+        )
@@ -0,0 +1,102 @@
+import numpy as np
+
+
+def normalize_rows(X):
+    """Scales every row to unit length, so distances follow cosine similarity."""
+    X = np.asarray(X, dtype=np.float32)
+    return X / np.maximum(np.linalg.norm(X, axis=1), 1e-8)[:, None]
+
+
+def compute_sq_distances(X, centroids):
+    """Squared euclidean distance of every row to every centroid."""
+    return (
+        (X**2).sum(axis=1)[:, None]
+        - 2 * X @ centroids.T
+        + (centroids**2).sum(axis=1)[None, :]
+    )
+
+
+def assign_clusters(X, centroids, chunk_size=65_536):
+    """Nearest centroid and squared distance to it for every row, in chunks."""
+    labels = np.empty(len(X), dtype=np.int32)
+    distances = np.empty(len(X), dtype=np.float32)
+    for start in range(0, len(X), chunk_size):
+        d = compute_sq_distances(X[start : start + chunk_size], centroids)
+        labels[start : start + chunk_size] = d.argmin(axis=1)
+        distances[start : start + chunk_size] = np.maximum(d.min(axis=1), 0)
+    return labels, distances
+
+
+def init_centroids(X, n_clusters, rng):
+    """Picks initial centroids with k-means++ seeding."""
+    centroids = [X[rng.integers(len(X))]]
+    d = compute_sq_distances(X, centroids[0][None]).ravel()
+    for _ in range(1, n_clusters):
+        p = np.maximum(d, 0)
+        idx = rng.choice(len(X), p=p / p.sum()) if p.sum() > 0 else rng.integers(len(X))
+        centroids.append(X[idx])
+        d = np.minimum(d, compute_sq_distances(X, X[idx][None]).ravel())
+    return np.stack(centroids).astype(np.float32)
+
+
+def minibatch_kmeans(X, n_clusters, batch_size=1024, n_iter=100, seed=42):
+    """Clusters the rows of X with mini-batch k-means (Sculley, 2010).
+
+    Every iteration assigns a random batch to its nearest centroids and moves each
+    centroid towards the mean of its batch members, with a per-centroid learning
+    rate that decays with the number of rows it has seen so far.
+    """
+    rng = np.random.default_rng(seed)
+    X = np.asarray(X, dtype=np.float32)
+    n_clusters = min(n_clusters, len(X))
+
+    centroids = init_centroids(X, n_clusters, rng)
+    counts = np.zeros(n_clusters)
+    for _ in range(n_iter):
+        batch = X[rng.choice(len(X), size=min(batch_size, len(X)), replace=False)]
+        labels = compute_sq_distances(batch, centroids).argmin(axis=1)
+
+        n_batch = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, batch)
+
+        seen = n_batch > 0
+        counts[seen] += n_batch[seen]
+        lr = (n_batch[seen] / counts[seen])[:, None]
+        centroids[seen] = (1 - lr) * centroids[seen] + lr * (
+            sums[seen] / n_batch[seen][:, None]
+        )
+
+    labels, distances = assign_clusters(X, centroids)
+
+    return centroids, labels, distances
+
+
+def compute_pca_projection(X, n_components=3):
+    """Projects the rows of X on their first principal components."""
+    X = np.asarray(X, dtype=np.float32)
+    X_centered = X - X.mean(axis=0)
+    _, s, vt = np.linalg.svd(X_centered, full_matrices=False)
+
+    explained = s**2 / max((s**2).sum(), 1e-12)
+    return X_centered @ vt[:n_components].T, explained[:n_components]
+
+
+def build_archetypes(names, factors, n_clusters, seed=42):
+    """Clusters riders on their embeddings and projects them in 3D (and 2D).
+
+    Returns arrays to store as model file, with the clusters and coordinates of
+    every rider aligned with the given names.
+    """
+    X = normalize_rows(factors)
+    centroids, labels, distances = minibatch_kmeans(X, n_clusters, seed=seed)
+    projection, explained = compute_pca_projection(X, n_components=3)
+
+    return {
+        "names": np.asarray(names, dtype=str),
+        "labels": labels,
+        "distances": distances,  # to own centroid, the lower the more typical
+        "centroids": centroids,
+        "projection": projection.astype(np.float32),  # first 2 columns give 2D
+        "explained_variance": explained.astype(np.float32),
+    }
@@ -0,0 +1,103 @@
+import numpy as np
+
+EMBEDDING_DTYPES = ["int8", "float16", "float32"]  # from smallest to largest
+
+
+def quantize_factors(factors, dtype):
+    """Converts a float32 factor matrix into the given storage dtype.
+
+    Returns the stored values and a per-row scale, which is only different from one
+    for int8, where every row is mapped symmetrically onto [-127, 127].
+    """
+    assert dtype in EMBEDDING_DTYPES, f"Dtype should be one of {EMBEDDING_DTYPES}."
+    factors = np.asarray(factors, dtype=np.float32)
+    scales = np.ones(factors.shape[0], dtype=np.float32)
+
+    if dtype == "int8":
+        absmax = np.abs(factors).max(axis=1)
+        scales = np.where(absmax > 0, absmax / 127, 1).astype(np.float32)
+        values = np.clip(np.rint(factors / scales[:, None]), -127, 127).astype(np.int8)
+    else:
+        values = factors.astype(dtype)
+
+    return values, scales
+
+
+def dequantize_factors(values, scales):
+    """Reconstructs the float32 factor matrix from its stored values and scales."""
+    return values.astype(np.float32) * scales[:, None]
+
+
+def compute_row_norms(values):
+    """L2 norm of every stored row, precomputed once to speed up cosine similarity."""
+    return np.linalg.norm(values.astype(np.float32), axis=1)
+
+
+def compute_cosine_similarity(values, norms, idx_base, idx_popu):
+    """Cosine similarity between one base row and a population of rows.
+
+    Works directly on the stored values since a positive per-row scale cancels out.
+    """
+    base = values[idx_base].astype(np.float32)
+    popu = values[idx_popu].astype(np.float32)
+    denom = np.maximum(norms[idx_popu] * norms[idx_base], 1e-8)
+    return (popu @ base) / denom
+
+
+def get_topk_neighbours(factors, idx_queries, k, chunk_size=1024):
+    """Indices of the k nearest rows (by cosine similarity) for each query row."""
+    factors = np.asarray(factors, dtype=np.float32)
+    normed = factors / np.maximum(np.linalg.norm(factors, axis=1), 1e-8)[:, None]
+
+    out = np.empty((len(idx_queries), k), dtype=np.int64)
+    for start in range(0, len(idx_queries), chunk_size):
+        idx = np.asarray(idx_queries[start : start + chunk_size])
+        sim = normed[idx] @ normed.T
+        sim[np.arange(len(idx)), idx] = -np.inf  # a rider is not its own neighbour
+        top = np.argpartition(-sim, k, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(sim, top, axis=1), axis=1)
+        out[start : start + len(idx)] = np.take_along_axis(top, order, axis=1)
+
+    return out
+
+
+def compute_topk_overlap(reference, candidate, k=10, n_queries=1000, seed=42):
+    """Average share of the top-k neighbours in `reference` retrieved by `candidate`."""
+    n_rows = reference.shape[0]
+    k = min(k, n_rows - 1)
+    rng = np.random.default_rng(seed)
+    idx_queries = rng.choice(n_rows, size=min(n_queries, n_rows), replace=False)
+
+    top_ref = get_topk_neighbours(reference, idx_queries, k)
+    top_cand = get_topk_neighbours(candidate, idx_queries, k)
+
+    hits = (top_ref[:, :, None] == top_cand[:, None, :]).any(axis=2)
+    return float(hits.mean())
+
+
+def build_embeddings_report(factors, k=10):
+    """Top-k overlap against float32 and storage size for every embedding dtype."""
+    report = {}
+    for dtype in EMBEDDING_DTYPES:
+        values, scales = quantize_factors(factors, dtype)
+        report[dtype] = {
+            "topk_overlap": compute_topk_overlap(
+                factors, dequantize_factors(values, scales), k=k
+            ),
+            "n_bytes": int(values.nbytes + (scales.nbytes if dtype == "int8" else 0)),
+        }
+    return report
+
+
+def select_embedding_dtype(report, min_topk_overlap):
+    """Picks the smallest dtype whose top-k overlap with float32 is high enough."""
+    for dtype in EMBEDDING_DTYPES:
+        if report[dtype]["topk_overlap"] >= min_topk_overlap:
+            return dtype
+    return "float32"
+
+
+def export_embeddings(names, factors, dtype):
+    """Bundles rider names and quantized factors into arrays to store as model file."""
+    values, scales = quantize_factors(factors, dtype)
+    return {"names": np.asarray(names, dtype=str), "values": values, "scales": scales}
@@ -0,0 +1,172 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.embeddings import get_topk_neighbours
+from src.model_format import read_model
+
+# normalization modes where a lower result means a better performance
+LOWER_IS_BETTER = ["1-20"]
+
+
+def to_model(tensors, metadata):
+    """Combines the stored tensors with the metadata needed for evaluation."""
+    return {
+        **tensors,
+        "normalize": metadata["normalize"],
+        "y_range": np.asarray(metadata["y_range"], dtype=np.float32),
+    }
+
+
+def load_model(file):
+    """Reads a model file stored by the training pipeline."""
+    return to_model(*read_model(file))
+
+
+def read_holdout(file):
+    """Reads the held-out ratings written next to the training ratings."""
+    return pd.read_csv(file, dtype={"rider": str, "stage": str}, encoding="utf-8")
+
+
+def lookup(names, elements):
+    """Positions of the elements in the vocabulary, -1 if unknown."""
+    return pd.Index(names).get_indexer(elements)
+
+
+def predict_ratings(model, riders, stages):
+    """Predicted ratings for (rider, stage) pairs, NaN if either one is unknown.
+
+    Mirrors the forward pass of fastai's EmbeddingDotBias for the full batch.
+    """
+    i = lookup(model["rider_names"], riders)
+    j = lookup(model["stage_names"], stages)
+    known = (i >= 0) & (j >= 0)
+
+    i, j = i[known], j[known]
+    dot = (model["rider_factors"][i] * model["stage_factors"][j]).sum(axis=1)
+    x = dot + model["rider_bias"][i] + model["stage_bias"][j]
+
+    low, high = model["y_range"]
+    preds = np.full(len(known), np.nan, dtype=np.float32)
+    preds[known] = low + (high - low) / (1 + np.exp(-x))  # sigmoid range
+    return preds
+
+
+def get_holdout_normalize(df_holdout):
+    """Normalize mode the held-out results are expressed in, None if unknown."""
+    modes = df_holdout["normalize"].unique() if "normalize" in df_holdout else []
+    return modes[0] if len(modes) == 1 else None
+
+
+def compute_rmse(model, df_holdout):
+    """Root mean squared error on the held-out ratings of known riders and stages.
+
+    Results that the normalize mode leaves without a rating are skipped.
+    """
+    preds = predict_ratings(model, df_holdout["rider"], df_holdout["stage"])
+    results = df_holdout["result"].to_numpy(dtype=np.float32)
+    known = ~np.isnan(preds) & ~np.isnan(results)
+    errors = preds[known] - results[known]
+    return float(np.sqrt(np.mean(errors**2))) if known.any() else np.nan
+
+
+def compute_recall_at_k(model, df_holdout, k=10, top_n=10):
+    """Average share of the actual top-n of each held-out stage predicted in top-k.
+
+    Riders are ranked per stage among the held-out riders of that stage, unknown
+    riders are ranked last.
+    """
+    preds = predict_ratings(model, df_holdout["rider"], df_holdout["stage"])
+    if model["normalize"] in LOWER_IS_BETTER:
+        preds = -preds
+
+    df = pd.DataFrame(
+        {
+            "stage": df_holdout["stage"].to_numpy(),
+            "score": np.nan_to_num(preds, nan=-np.inf),
+            "relevant": df_holdout["rank"].to_numpy() <= top_n,
+        }
+    )
+    predicted = df.groupby("stage")["score"].rank(ascending=False, method="first") <= k
+    df["hits"] = predicted & df["relevant"]
+
+    per_stage = df.groupby("stage")[["hits", "relevant"]].sum()
+    per_stage = per_stage[per_stage["relevant"] > 0]
+    return (
+        float((per_stage["hits"] / per_stage["relevant"]).mean())
+        if len(per_stage) > 0
+        else np.nan
+    )
+
+
+def align_riders(model_a, model_b):
+    """Rider factors of both models restricted to and aligned on common riders."""
+    names = np.intersect1d(model_a["rider_names"], model_b["rider_names"])
+    names = names[names != "#na#"]
+    return (
+        names,
+        model_a["rider_factors"][lookup(model_a["rider_names"], names)],
+        model_b["rider_factors"][lookup(model_b["rider_names"], names)],
+    )
+
+
+def compute_neighbour_stability(
+    model_a, model_b, k=10, n_queries=None, n_workers=4, chunk_size=1024, seed=42
+):
+    """Average share of the top-k neighbours of a rider kept from one model to another.
+
+    Neighbours are searched among riders known to both models. Chunks of query
+    riders are spread over threads, as numpy releases the GIL in matrix products.
+    """
+    names, factors_a, factors_b = align_riders(model_a, model_b)
+    k = min(k, len(names) - 1)
+
+    idx_queries = np.arange(len(names))
+    if n_queries is not None and n_queries < len(names):
+        idx_queries = np.random.default_rng(seed).choice(
+            len(names), size=n_queries, replace=False
+        )
+
+    def overlap(idx):
+        top_a = get_topk_neighbours(factors_a, idx, k)
+        top_b = get_topk_neighbours(factors_b, idx, k)
+        return (top_a[:, :, None] == top_b[:, None, :]).any(axis=2).sum()
+
+    chunks = [
+        idx_queries[start : start + chunk_size]
+        for start in range(0, len(idx_queries), chunk_size)
+    ]
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        hits = sum(executor.map(overlap, chunks))
+
+    return float(hits / (len(idx_queries) * k))
+
+
+def evaluate_model(model, df_holdout, k=10):
+    """Holdout metrics of a model, without rmse if the results are on another scale."""
+    same_scale = model["normalize"] == get_holdout_normalize(df_holdout)
+    return {
+        "normalize": model["normalize"],
+        "n_factors": int(model["rider_factors"].shape[1]),
+        "n_riders": len(model["rider_names"]) - 1,  # skip '#na#' placeholder
+        "rmse": compute_rmse(model, df_holdout) if same_scale else None,
+        f"recall@{k}": compute_recall_at_k(model, df_holdout, k=k),
+    }
+
+
+def compare_models(model_a, model_b, df_holdout=None, k=10, **kwargs):
+    """Holdout metrics of both models, and the stability of rider neighbours."""
+    report = {}
+    if df_holdout is not None:
+        report["n_holdout"] = len(df_holdout)
+        report["holdout_normalize"] = get_holdout_normalize(df_holdout)
+        report["a"] = evaluate_model(model_a, df_holdout, k=k)
+        report["b"] = evaluate_model(model_b, df_holdout, k=k)
+
+    report["n_common_riders"] = len(align_riders(model_a, model_b)[0])
+    report[f"neighbour_stability@{k}"] = compute_neighbour_stability(
+        model_a, model_b, k=k, **kwargs
+    )
+
+    return report
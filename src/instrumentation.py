@@ -0,0 +1,119 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def get_peak_rss_mb():
+    """Returns the peak resident set size of the process so far in MB."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024  # bytes vs KB
+
+
+def get_current_rss_mb():
+    """Returns the current resident set size of the process in MB (Linux only)."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024**2
+
+
+def subtract(a, b):
+    return None if a is None or b is None else a - b
+
+
+class PipelineMonitor:
+    """Records wall time, peak memory and counters for every stage of a pipeline."""
+
+    def __init__(self, name, run_date=None):
+        self.name = name
+        self.run_date = run_date
+        self.stages = {}
+        self.current = None
+        self.lock = threading.Lock()  # counters are also updated from worker threads
+        self.start = time.perf_counter()
+
+    def _get_stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = {
+                "wall_s": 0.0,
+                "rss_start_mb": None,  # current memory when the stage is entered
+                "rss_end_mb": None,  # and when it is left
+                "peak_rss_increase_mb": 0.0,  # by how much it raised the peak
+                "status": "running",
+                "counters": defaultdict(int),
+            }
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name):
+        """Times a stage; counters recorded inside it are attributed to the stage."""
+        stage, previous = self._get_stage(name), self.current
+        self.current = name
+        start, peak_start = time.perf_counter(), get_peak_rss_mb()
+        if stage["rss_start_mb"] is None:
+            stage["rss_start_mb"] = get_current_rss_mb()
+        try:
+            yield stage
+            stage["status"] = "ok"
+        except BaseException:
+            stage["status"] = "failed"
+            raise
+        finally:
+            stage["wall_s"] += time.perf_counter() - start
+            stage["rss_end_mb"] = get_current_rss_mb()
+            increase = subtract(get_peak_rss_mb(), peak_start)
+            if increase is not None:
+                stage["peak_rss_increase_mb"] += increase
+            self.current = previous
+
+    def count(self, key, value=1):
+        """Increments a counter (e.g. 's3_bytes') of the current stage."""
+        with self.lock:
+            self._get_stage(self.current or "other")["counters"][key] += value
+
+    @contextmanager
+    def request(self, source):
+        """Counts a request to source (e.g. 's3' or 'pcs') and whether it failed."""
+        self.count(f"{source}_requests")
+        try:
+            yield
+        except BaseException:
+            self.count(f"{source}_failures")
+            raise
+
+    def to_dict(self):
+        return {
+            "pipeline": self.name,
+            "run_date": self.run_date,
+            "wall_s": time.perf_counter() - self.start,
+            "peak_rss_mb": get_peak_rss_mb(),
+            "stages": {
+                name: {**stage, "counters": dict(stage["counters"])}
+                for name, stage in self.stages.items()
+            },
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=4)
+
+    def print_summary(self):
+        for name, stage in self.stages.items():
+            counters = ", ".join(f"{k}={v}" for k, v in stage["counters"].items())
+            print(
+                f"{name:<20} {stage['status']:<7} {stage['wall_s']:>8.1f}s "
+                f"{stage['rss_end_mb'] or float('nan'):>8.0f}MB "
+                f"(peak +{stage['peak_rss_increase_mb']:.0f}MB)  {counters}"
+            )
@@ -0,0 +1,75 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+SIZE_BUCKETS = (10, 100, 1_000, 10_000, 100_000, 1_000_000)
+
+
+def format_series(name, labels):
+    """Formats a series name with its labels, e.g. 'name{phase="filter"}'."""
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    """Prometheus-style histogram with cumulative buckets per set of labels."""
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.series = defaultdict(lambda: [[0] * (len(self.buckets) + 1), 0.0, 0])
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        with self.lock:
+            counts, _, _ = series = self.series[tuple(sorted(labels.items()))]
+            counts[bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the wall time in seconds spent inside the context."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self.lock:
+            for labels, (counts, total, count) in self.series.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += n
+                    series = format_series(
+                        f"{self.name}_bucket", labels + (("le", bound),)
+                    )
+                    lines.append(f"{series} {cumulative}")
+                lines.append(f"{format_series(f'{self.name}_sum', labels)} {total}")
+                lines.append(f"{format_series(f'{self.name}_count', labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collects histograms and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self.histograms = []
+
+    def histogram(self, name, description, buckets=LATENCY_BUCKETS):
+        histogram = Histogram(name, description, buckets)
+        self.histograms.append(histogram)
+        return histogram
+
+    def render(self):
+        return "\n".join(line for h in self.histograms for line in h.render()) + "\n"
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import struct
+
+import numpy as np
+
+FORMAT_NAME = "cyclingsimilarity-model"
+FORMAT_VERSION = 1
+
+ALIGNMENT = 64  # bytes, every tensor starts at a multiple of this offset
+
+
+def align(n):
+    return -(-n // ALIGNMENT) * ALIGNMENT
+
+
+def build_manifest(tensors, metadata=None):
+    """Describes where every tensor sits in the data section, plus any metadata."""
+    entries, offset = {}, 0
+    for name, array in tensors.items():
+        entries[name] = {
+            "dtype": array.dtype.str,  # with byte order, e.g. '<f4' or '<U24'
+            "shape": list(array.shape),
+            "offset": offset,
+            "nbytes": array.nbytes,
+        }
+        offset = align(offset + array.nbytes)
+
+    return {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "tensors": entries,
+        "metadata": metadata or {},
+    }
+
+
+def serialize_model(tensors, metadata=None):
+    """Packs named numpy arrays and JSON metadata into a pickle-free binary layout.
+
+    Like safetensors, the file starts with the length of a JSON manifest, followed
+    by the manifest and a data section with the raw bytes of every tensor. The
+    manifest holds a SHA-256 checksum of the data section.
+    """
+    tensors = {k: np.ascontiguousarray(v) for k, v in tensors.items()}
+    for name, array in tensors.items():
+        assert not array.dtype.hasobject, f"Tensor {name} should not hold objects."
+
+    manifest = build_manifest(tensors, metadata)
+    data = bytearray(
+        max([e["offset"] + e["nbytes"] for e in manifest["tensors"].values()] + [0])
+    )
+    for name, array in tensors.items():
+        start = manifest["tensors"][name]["offset"]
+        data[start : start + array.nbytes] = array.tobytes()
+    manifest["sha256"] = hashlib.sha256(data).hexdigest()
+
+    header = json.dumps(manifest).encode("utf-8")
+    header += b" " * (align(8 + len(header)) - 8 - len(header))  # align data section
+
+    return struct.pack("<Q", len(header)) + header + bytes(data)
+
+
+def validate_manifest(manifest, n_data):
+    """Checks that a manifest is complete and only points inside the data section."""
+    if not isinstance(manifest, dict) or manifest.get("format") != FORMAT_NAME:
+        raise ValueError("Not a model file, the format is unknown.")
+    if not isinstance(manifest.get("version"), int):
+        raise ValueError("Model manifest has no valid format version.")
+    if manifest["version"] > FORMAT_VERSION:
+        raise ValueError(
+            f"Model format version {manifest['version']} is newer than supported "
+            f"version {FORMAT_VERSION}, update the code first."
+        )
+    if not isinstance(manifest.get("sha256"), str):
+        raise ValueError("Model manifest has no checksum.")
+    if not isinstance(manifest.get("tensors"), dict):
+        raise ValueError("Model manifest has no tensors.")
+
+    for name, e in manifest["tensors"].items():
+        try:
+            dtype = np.dtype(e["dtype"])
+            shape = [int(n) for n in e["shape"]]
+            offset, nbytes = e["offset"], e["nbytes"]
+        except (KeyError, TypeError, ValueError) as error:
+            raise ValueError(f"Model manifest entry of {name} is invalid.") from error
+        if dtype.hasobject or min(shape, default=0) < 0:
+            raise ValueError(f"Model manifest entry of {name} is invalid.")
+        if nbytes != int(np.prod(shape)) * dtype.itemsize:
+            raise ValueError(f"Size of tensor {name} doesn't match its shape.")
+        if not (isinstance(offset, int) and 0 <= offset and offset + nbytes <= n_data):
+            raise ValueError(f"Tensor {name} lies outside the data section.")
+
+
+def deserialize_model(buffer, verify=True):
+    """Unpacks tensors and metadata, as read-only views on the buffer (no copies).
+
+    Raises a ValueError for another format, a newer version, an inconsistent
+    manifest or a bad checksum.
+    """
+    buffer = memoryview(buffer).cast("B")
+    if len(buffer) < 8:
+        raise ValueError("Not a model file, it is too short.")
+    (n_header,) = struct.unpack("<Q", buffer[:8])
+    if n_header > len(buffer) - 8:
+        raise ValueError("Not a model file, the manifest is cut off.")
+    try:
+        manifest = json.loads(bytes(buffer[8 : 8 + n_header]))
+    except ValueError as e:
+        raise ValueError("Not a model file, the manifest can't be read.") from e
+
+    data = buffer[8 + n_header :]
+    validate_manifest(manifest, len(data))
+    if verify and hashlib.sha256(data).hexdigest() != manifest["sha256"]:
+        raise ValueError("Model file is corrupt, its checksum doesn't match.")
+
+    tensors = {
+        name: np.frombuffer(
+            data,
+            dtype=np.dtype(e["dtype"]),
+            count=int(np.prod(e["shape"])),
+            offset=e["offset"],
+        ).reshape(e["shape"])
+        for name, e in manifest["tensors"].items()
+    }
+
+    return tensors, manifest.get("metadata", {})
+
+
+def write_model(file, tensors, metadata=None):
+    with open(file, "wb") as f:
+        f.write(serialize_model(tensors, metadata))
+
+
+def read_model(file, verify=True):
+    """Reads a model file through a memory map, so tensors are only paged in on use."""
+    return deserialize_model(np.memmap(file, dtype=np.uint8, mode="r"), verify=verify)
@@ -0,0 +1,55 @@
+import sys
+import threading
+from collections import Counter
+
+
+class SamplingProfiler:
+    """Samples the call stacks of all threads at a fixed interval.
+
+    Stacks are aggregated in the collapsed format ('outer;inner count') that flame
+    graph tools understand, so hot paths can be inspected without a redeploy.
+    """
+
+    def __init__(self):
+        self.stacks = Counter()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.n_samples = 0
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, interval=0.01):
+        if self.running:
+            return
+        self.stacks.clear()
+        self.n_samples = 0
+        self.stop_event.clear()
+        self.thread = threading.Thread(
+            target=self._sample, args=(interval,), name="sampling-profiler", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        if self.running:
+            self.stop_event.set()
+            self.thread.join()
+        return self.collapsed()
+
+    def _sample(self, interval):
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.n_samples += 1
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {n}" for stack, n in self.stacks.most_common())
@@ -0,0 +1,200 @@
+import json
+import os
+import os.path as path
+
+import numpy as np
+import pandas as pd
+import torch
+from fastai.data.core import DataLoaders
+from fastai.data.load import DataLoader
+from fastai.data.transforms import CategoryMap
+
+from src.utils import get_result_weights, normalize_results_by_race
+
+INDEX_DTYPES = {"year": str, "stage_slug": str, "class": str}
+
+# one raw binary file per column of the long-format ratings
+RATINGS_COLUMNS = {"rider": np.int32, "stage": np.int32, "result": np.float32}
+
+# held-out ratings, with the original rank to evaluate predicted race top-10s
+HOLDOUT_FILE = "holdout.csv"
+
+
+def read_results_in_chunks(file, chunksize, **kwargs):
+    """Iterates over the wide results csv in chunks of races (rows)."""
+    return pd.read_csv(
+        file, index_col=[0, 1, 2], dtype=INDEX_DTYPES, chunksize=chunksize, **kwargs
+    )
+
+
+def count_participations(file, chunksize):
+    """First pass: counts the results per rider and lists all stages and years."""
+    counts, stages, years = None, [], set()
+    for chunk in read_results_in_chunks(file, chunksize):
+        n = chunk.count(axis=0)
+        counts = n if counts is None else counts.add(n, fill_value=0)
+        stages += chunk.index.get_level_values("stage_slug").tolist()
+        years |= set(chunk.index.get_level_values("year").astype(int))
+
+    return counts.astype(int), stages, years
+
+
+def prepare_ratings(
+    file,
+    dir_out,
+    n_participations,
+    normalize,
+    curr_year,
+    chunksize=500,
+    holdout_frac=0.0,
+    seed=42,
+):
+    """Writes normalized and weighted long-format ratings to disk, chunk by chunk.
+
+    Normalization and weighting work per race, so the result equals processing
+    the full table at once, but memory only depends on the chunk size.
+
+    With a holdout fraction, that share of the results of the most recent year is
+    left out of the ratings and written to a separate csv file for evaluation. Which
+    results are held out doesn't depend on the normalize mode, so models of
+    different modes are evaluated on the same results.
+    """
+    counts, stages, years = count_participations(file, chunksize)
+    year_holdout = max(years) if holdout_frac > 0 else None
+    rng = np.random.default_rng(seed)
+    holdout = []
+    riders = counts.index[counts >= n_participations].tolist()
+
+    classes = {
+        "rider": CategoryMap(riders, add_na=True),
+        "stage": CategoryMap(stages, add_na=True),
+    }
+    rider_codes = np.array([classes["rider"].o2i[r] for r in riders], dtype=np.int32)
+
+    os.makedirs(dir_out, exist_ok=True)
+    files = {c: open(path.join(dir_out, f"{c}.bin"), "wb") for c in RATINGS_COLUMNS}
+    try:
+        for chunk in read_results_in_chunks(
+            file, chunksize, usecols=list(INDEX_DTYPES) + riders
+        ):
+            chunk = chunk[riders]  # keep rider codes aligned with the columns
+            ranks = chunk.to_numpy(dtype=float)
+            chunk = normalize_results_by_race(chunk, how=normalize).astype(float)
+
+            weights = get_result_weights(chunk.index.to_frame(index=False), curr_year)
+            values = chunk.to_numpy() * weights[:, None]  # scale results by weights
+
+            i, j = np.nonzero(~np.isnan(values))  # rider = user, stage = item
+            stage_codes = np.array(
+                [classes["stage"].o2i[s] for s in chunk.index.get_level_values(1)],
+                dtype=np.int32,
+            )
+
+            if year_holdout is not None:
+                # drawn from the raw ranks, so every normalize mode holds out the
+                # same results, also those the mode leaves without a rating
+                hi, hj = np.nonzero(~np.isnan(ranks))
+                is_recent = chunk.index.get_level_values(0).astype(int) == year_holdout
+                held = is_recent[hi] & (rng.random(len(hi)) < holdout_frac)
+                hi, hj = hi[held], hj[held]
+                holdout.append(
+                    pd.DataFrame(
+                        {
+                            "rider": np.asarray(riders)[hj],
+                            "stage": chunk.index.get_level_values(1)[hi],
+                            "result": values[hi, hj],
+                            "rank": ranks[hi, hj],
+                            "normalize": normalize,  # scale of the results
+                        }
+                    )
+                )
+                is_held = np.zeros(values.shape, dtype=bool)
+                is_held[hi, hj] = True
+                keep = ~is_held[i, j]
+                i, j = i[keep], j[keep]
+
+            rider_codes[j].tofile(files["rider"])
+            stage_codes[i].tofile(files["stage"])
+            values[i, j].astype(np.float32).tofile(files["result"])
+    finally:
+        for f in files.values():
+            f.close()
+
+    with open(path.join(dir_out, "classes.json"), "w") as f:
+        json.dump({k: list(v) for k, v in classes.items()}, f)
+
+    if year_holdout is not None:
+        pd.concat(holdout, ignore_index=True).to_csv(
+            path.join(dir_out, HOLDOUT_FILE), index=False, encoding="utf-8"
+        )
+
+    return MemmapRatings(dir_out)
+
+
+class MemmapRatings:
+    """Long-format (rider, stage, result) ratings memory-mapped from disk."""
+
+    def __init__(self, dir_ratings):
+        self.dir = dir_ratings
+        with open(path.join(dir_ratings, "classes.json")) as f:
+            self.classes = {
+                k: CategoryMap(v, sort=False) for k, v in json.load(f).items()
+            }
+        self._open()
+
+    def _open(self):
+        for column, dtype in RATINGS_COLUMNS.items():
+            file = path.join(self.dir, f"{column}.bin")
+            setattr(self, column, np.memmap(file, dtype=dtype, mode="r"))
+
+    def __len__(self):
+        return len(self.result)
+
+    def __getstate__(self):
+        # pickle the location of the ratings instead of the ratings themselves
+        return {"dir": self.dir, "classes": self.classes}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if path.exists(self.dir):
+            self._open()
+
+    def get_batch(self, idx):
+        idx = np.sort(idx)  # sequential reads from the memory map
+        x = np.stack([self.rider[idx], self.stage[idx]], axis=1).astype(np.int64)
+        return torch.from_numpy(x), torch.from_numpy(self.result[idx].copy())[:, None]
+
+    def dataloaders(self, bs=64, valid_pct=0.2, seed=None):
+        """Splits the ratings randomly in a training and validation set."""
+        idxs = np.random.default_rng(seed).permutation(len(self))
+        cut = int(len(idxs) * (1 - valid_pct))
+
+        return DataLoaders(
+            RatingsDataLoader(RatingsSubset(self, idxs[:cut]), bs=bs, shuffle=True),
+            RatingsDataLoader(RatingsSubset(self, idxs[cut:]), bs=bs * 2),
+        )
+
+
+class RatingsSubset:
+    """Subset of ratings by position, exposing the classes like a fastai dataset."""
+
+    def __init__(self, ratings, idxs):
+        self.ratings = ratings
+        self.idxs = idxs
+
+    def __len__(self):
+        return len(self.idxs)
+
+    def __getitem__(self, i):
+        return self.idxs[i]
+
+    @property
+    def classes(self):
+        return self.ratings.classes
+
+
+class RatingsDataLoader(DataLoader):
+    """Fetches every batch with one vectorized read instead of item by item."""
+
+    def create_batch(self, b):
+        return self.dataset.ratings.get_batch(np.asarray(b))
@@ -1,26 +1,48 @@
-import pathlib
 import re
-from platform import system
+from functools import lru_cache
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from fastai.collab import load_learner
+import requests
 from procyclingstats import Rider
 from procyclingstats.errors import UnexpectedParsingError
 from torch import nn, tensor
 from unidecode import unidecode
 
+from src.clustering import compute_pca_projection
 
-def try_to_parse(obj, slug, printit=False):
+
+def fetch_scraper(obj, slug, monitor=None):
+    """Creates a scraper from one request, counting the bytes it transferred."""
+    url = obj(slug, update_html=False).url  # only resolves the url
+    response = requests.get(url)
+    if monitor is not None:
+        monitor.count(
+            "pcs_bytes",
+            int(response.headers.get("Content-Length", len(response.content))),
+        )  # as sent, so possibly compressed
+
+    return obj(url, html=response.text, update_html=False)
+
+
+def try_to_parse(obj, slug, printit=False, monitor=None):
     if printit:
         print(f"Parsing > {slug} ...")
 
+    if monitor is not None:
+        monitor.count("pcs_requests")
+
     parsed = None  # fallback
     try:
-        parsed = obj(slug).parse()
+        scraper = fetch_scraper(obj, slug, monitor)
+        parsed = scraper.parse()
     except (ValueError, AttributeError, UnexpectedParsingError):
         print(f"Oopsie! This one failed: {slug}")
+
+    if monitor is not None and parsed is None:
+        monitor.count("pcs_failures")
+
     return parsed
 
 
@@ -42,37 +64,43 @@ def clean_rider_name(name):
     return re.sub(r"\s+", " ", name.replace("\t", ""))
 
 
+# these manual conversions are of important riders
+# with a different slug than their used name
+MANUAL_SLUG_CONVERSIONS = {
+    "CORT Magnus": "magnus-cort-nielsen",
+    "AYUSO Juan": "juan-ayuso-pesquera",
+    "FROOME Chris": "christopher-froome",
+    "DUNBAR Eddie": "edward-irl-dunbar",
+    "RODRÍGUEZ Carlos": "carlos-rodriguez-cano",
+    "BARTA Will": "william-barta",
+    "HONORÉ Mikkel Frølich": "mikkel-honore",
+    "HERRADA Jesús": "jesus-herrada-lopez",
+    "GROßSCHARTNER Felix": "felix-grossschartner",
+    "DREßLER Luca": "luca-dressler",
+    "BUITRAGO Santiago": "santiago-buitrago-sanchez",
+    "CHAVES Esteban": "johan-esteban-chaves",
+    "MÜLLER Tobias": "tobias-muller1",
+    "RÜEGG Timon": "timin-ruegg",
+    "SCULLY Tom": "thomas-scully",
+    "SKJELMOSE Mattias": "mattias-skjelmose-jensen",
+    "VALGREN Michael": "michael-valgren-andersen",
+    "VINGEGAARD Jonas": "jonas-vingegaard-rasmussen",
+    "WRIGHT Fred": "alfred-wright",
+}
+
+RIDER_REGISTRY_COLUMNS = ["rider_name", "rider_slug", "nationality", "birth_date"]
+
+
+@lru_cache(maxsize=None)
 def convert_name_to_slug(name):
     """Convert input from 'FAMILY NAME First Name' to 'first-name-family-name'."""
-    # these manual conversions are of important riders
-    # with a different slug than their used name
-    dict_manual_conversions = {
-        "CORT Magnus": "magnus-cort-nielsen",
-        "AYUSO Juan": "juan-ayuso-pesquera",
-        "FROOME Chris": "christopher-froome",
-        "DUNBAR Eddie": "edward-irl-dunbar",
-        "RODRÍGUEZ Carlos": "carlos-rodriguez-cano",
-        "BARTA Will": "william-barta",
-        "HONORÉ Mikkel Frølich": "mikkel-honore",
-        "HERRADA Jesús": "jesus-herrada-lopez",
-        "GROßSCHARTNER Felix": "felix-grossschartner",
-        "DREßLER Luca": "luca-dressler",
-        "BUITRAGO Santiago": "santiago-buitrago-sanchez",
-        "CHAVES Esteban": "johan-esteban-chaves",
-        "MÜLLER Tobias": "tobias-muller1",
-        "RÜEGG Timon": "timin-ruegg",
-        "SCULLY Tom": "thomas-scully",
-        "SKJELMOSE Mattias": "mattias-skjelmose-jensen",
-        "VALGREN Michael": "michael-valgren-andersen",
-        "VINGEGAARD Jonas": "jonas-vingegaard-rasmussen",
-        "WRIGHT Fred": "alfred-wright",
-    }
-    if name in dict_manual_conversions.keys():
-        return dict_manual_conversions[name]
+    if name in MANUAL_SLUG_CONVERSIONS:
+        return MANUAL_SLUG_CONVERSIONS[name]
 
+    parts = name.split(" ")
     slug = "-".join(
-        [_.lower() for _ in name.split(" ") if not _.isupper()]
-        + [_.lower() for _ in name.split(" ") if _.isupper()]
+        [_.lower() for _ in parts if not _.isupper()]
+        + [_.lower() for _ in parts if _.isupper()]
     )
 
     slug = slug.replace("--", "-")
@@ -82,11 +110,31 @@ def convert_name_to_slug(name):
     return slug
 
 
-def parse_rider_info(rider_slug):
+def convert_names_to_slugs(names):
+    """Converts many names at once, every distinct name is converted only once."""
+    names = pd.Series(names)
+    uniques = names.unique()
+    return names.map(dict(zip(uniques, map(convert_name_to_slug, uniques))))
+
+
+def read_rider_registry(file):
+    """Reads the registry of rider slugs and metadata, keyed by cleaned rider name."""
+    df_registry = pd.read_csv(
+        file, keep_default_na=False, na_values=[""], encoding="utf-8"
+    )  # country code 'NA' is Namibia, not a missing value
+    return df_registry.drop_duplicates(subset=["rider_name"], keep="last")
+
+
+def parse_rider_info(rider_slug, monitor=None):
+    if monitor is not None:
+        monitor.count("pcs_requests")
+
     try:
-        rider = Rider(f"rider/{rider_slug}")
+        rider = fetch_scraper(Rider, f"rider/{rider_slug}", monitor)
         return (rider.nationality(), rider.birthdate())
     except (ValueError, AttributeError):
+        if monitor is not None:
+            monitor.count("pcs_failures")
         return (None, None)
 
 
@@ -145,6 +193,16 @@ def get_gc_weight(gc: bool):
     return 1.25 if gc is True else 1
 
 
+def get_result_weights(df_index, curr_year):
+    """Combines all weights for races given as (year, stage_slug, class) rows."""
+    w_year = df_index["year"].astype(int).apply(get_year_weight, curr_year=curr_year)
+    w_class = df_index["class"].str.partition(".")[2].apply(get_race_class_weight)
+    w_stage = df_index["stage_slug"].str.contains("/stage-").apply(get_stage_weight)
+    w_gc = df_index["stage_slug"].str.contains("/gc").apply(get_gc_weight)
+
+    return (w_year * w_class * w_stage * w_gc).to_numpy()
+
+
 def get_y_range(how):
     """Returns the 'y_range' input needed in collab_learner()."""
     # the upper bound includes a slight buffer and is
@@ -179,6 +237,29 @@ def extract_bias(learn, dim):
     )
 
 
+def extract_model(learn, normalize):
+    """Weights and vocabularies of a trained model, with metadata to interpret them."""
+
+    def to_numpy(t):
+        return t.detach().cpu().numpy().astype(np.float32)
+
+    tensors = {
+        "rider_names": np.asarray(list(learn.dls.classes["rider"]), dtype=str),
+        "stage_names": np.asarray(list(learn.dls.classes["stage"]), dtype=str),
+        "rider_factors": to_numpy(extract_factors(learn, dim="rider")),
+        "stage_factors": to_numpy(extract_factors(learn, dim="stage")),
+        "rider_bias": to_numpy(extract_bias(learn, dim="rider")),
+        "stage_bias": to_numpy(extract_bias(learn, dim="stage")),
+    }
+    metadata = {
+        "normalize": normalize,
+        "y_range": [float(y) for y in learn.model.y_range],
+        "n_factors": tensors["rider_factors"].shape[1],
+    }
+
+    return tensors, metadata
+
+
 def extract_most_similar_elements(learn, dim="rider", element="VAN AERT Wout", n=20):
     assert dim in ["rider", "stage"], "Dimension should be 'rider' or 'stage'."
     factors = extract_factors(learn, dim)
@@ -197,10 +278,10 @@ def plot_pca(df, learn, dim, n_plot=50):
     top_idxs = tensor([learn.dls.classes[dim].o2i[m] for m in top_dim])
 
     factors = extract_factors(learn, dim)
-    w = factors[top_idxs].cpu().detach()
+    w = factors[top_idxs].cpu().detach().numpy()
 
-    pca = w.pca(3)
-    fac0, fac1, fac2 = pca.t()
+    projection, _ = compute_pca_projection(w, n_components=3)
+    fac0, fac1, fac2 = projection.T
     idxs = list(range(n_plot))
     X, Y = fac0[idxs], fac2[idxs]
 
@@ -211,12 +292,3 @@ def plot_pca(df, learn, dim, n_plot=50):
 
     plt.show()
 
-
-def read_learner(path_pkl):
-    if system() == "Linux":
-        pathlib.WindowsPath = (
-            pathlib.PosixPath
-        )  # if model is trained and stored on a Windows machine but deployed on Linux
-    learn = load_learner(path_pkl)
-
-    return learn
@@ -0,0 +1,62 @@
+import importlib
+import os.path as path
+import sys
+
+import numpy as np
+import pandas as pd
+
+DIR_API = path.join(path.dirname(path.dirname(path.abspath(__file__))), "api")
+sys.path.append(DIR_API)
+
+from src.clustering import build_archetypes
+from src.embeddings import export_embeddings
+from src.model_format import write_model
+
+RUN_DATE = "2023-10-01"
+
+N_FACTORS = 15
+
+COUNTRIES = ["BE", "FR", "NL", "IT", "ES", "DK", "DE", "GB", "CO", "US", "AU"]
+COUNTRIES_P = [0.2, 0.15, 0.12, 0.12, 0.1, 0.08, 0.07, 0.06, 0.04, 0.03, 0.03]
+
+
+def generate_artifacts(dir_out, n_riders, dtype, seed=42):
+    """Writes a synthetic set of API artifacts for n_riders riders to dir_out."""
+    rng = np.random.default_rng(seed)
+
+    names = [f"RIDER{i:06d} Synthetic" for i in range(n_riders)]
+    birth_dates = pd.Timestamp(RUN_DATE) - pd.to_timedelta(
+        rng.uniform(19, 40, size=n_riders) * 365.2425, unit="D"
+    )
+    df_riders = pd.DataFrame(
+        {
+            "rider_name": names,
+            "nationality": rng.choice(COUNTRIES, size=n_riders, p=COUNTRIES_P),
+            "birth_date": birth_dates.strftime("%Y-%m-%d"),
+        }
+    )
+    factors = rng.normal(size=(n_riders + 1, N_FACTORS)).astype(np.float32)
+
+    with open(path.join(dir_out, "last_successful_train_run.txt"), "w") as f:
+        f.write(RUN_DATE)
+    write_model(
+        path.join(dir_out, "rider_embeddings.tensors"),
+        export_embeddings(["#na#"] + names, factors, dtype=dtype),
+    )
+    df_riders.to_csv(path.join(dir_out, "df_riders_data.csv"), index=False)
+    write_model(
+        path.join(dir_out, "rider_archetypes.tensors"),
+        build_archetypes(names, factors[1:], n_clusters=8),
+    )
+
+    return names
+
+
+def import_api():
+    """(Re)imports the FastAPI backend, which reads its artifacts on import.
+
+    Set LOCAL_ARTIFACTS_DIR first to read them from a local folder.
+    """
+    if "main" in sys.modules:
+        return importlib.reload(sys.modules["main"])
+    return importlib.import_module("main")
@@ -0,0 +1,116 @@
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+from tests.synthetic import generate_artifacts, import_api
+
+
+@pytest.fixture(scope="module")
+def artifacts(tmp_path_factory):
+    dir_artifacts = tmp_path_factory.mktemp("artifacts")
+    names = generate_artifacts(str(dir_artifacts), n_riders=200, dtype="float32")
+
+    # the last rider has an embedding, but no metadata
+    file_riders = dir_artifacts / "df_riders_data.csv"
+    df_riders = pd.read_csv(file_riders)
+    df_riders[df_riders["rider_name"] != names[-1]].to_csv(file_riders, index=False)
+
+    return str(dir_artifacts), names
+
+
+@pytest.fixture
+def client(artifacts, monkeypatch):
+    dir_artifacts, names = artifacts
+    monkeypatch.setenv("LOCAL_ARTIFACTS_DIR", dir_artifacts)
+    return TestClient(import_api().app), names
+
+
+def test_similar_cyclists(client):
+    client, names = client
+    response = client.post(
+        "/list-similar-cyclists",
+        json={"cyclist": names[0], "n": 5, "age_min": 0, "age_max": 100},
+    )
+    assert response.status_code == 200
+    assert len(response.json()["cyclists"]) == 5
+
+    response = client.post("/list-similar-cyclists", json={"cyclist": "UNKNOWN Rider"})
+    assert response.status_code == 404
+
+
+def test_serialization_is_timed(client):
+    client, names = client
+    client.post("/list-similar-cyclists", json={"cyclist": names[1], "n": 3})
+
+    metrics = client.get("/metrics").text
+    assert 'api_similarity_phase_duration_seconds_count{phase="serialization"}' in (
+        metrics
+    )
+    assert client.post("/profiler/start", params={"interval_ms": 0}).status_code == 422
+
+
+def test_profiler_needs_token(artifacts, monkeypatch):
+    monkeypatch.setenv("LOCAL_ARTIFACTS_DIR", artifacts[0])
+    monkeypatch.setenv("ENABLE_PROFILER", "1")
+    monkeypatch.setenv("PROFILER_TOKEN", "secret")
+    client = TestClient(import_api().app)
+
+    assert client.post("/profiler/start").status_code == 403
+    headers = {"X-Profiler-Token": "wrong"}
+    assert client.post("/profiler/start", headers=headers).status_code == 403
+    assert client.post("/profiler/stop", headers=headers).status_code == 403
+
+    headers = {"X-Profiler-Token": "secret"}
+    assert client.post("/profiler/start", headers=headers).json() == {"running": True}
+    assert client.post("/profiler/stop", headers=headers).status_code == 200
+
+
+def test_archetype_endpoints_agree(client):
+    client, names = client
+    archetypes = client.get("/archetypes").json()["archetypes"]
+    listed = {name for cyclists in archetypes.values() for name in cyclists}
+
+    assert set(client.get("/projection").json()["cyclists"]) == listed
+    assert set(client.get("/projection?dims=3").json()["cyclists"]) == listed
+    assert names[-1] not in listed  # has no metadata
+    assert client.get(f"/archetypes/{names[-1]}").status_code == 404
+    assert client.get(f"/archetypes/{names[0]}").status_code == 200
+
+
+def test_archetypes_are_optional(tmp_path, monkeypatch):
+    names = generate_artifacts(str(tmp_path), n_riders=50, dtype="float32")
+    (tmp_path / "rider_archetypes.tensors").unlink()  # not trained yet
+    monkeypatch.setenv("LOCAL_ARTIFACTS_DIR", str(tmp_path))
+    client = TestClient(import_api().app)
+
+    assert client.get("/archetypes").status_code == 503
+    assert client.get(f"/archetypes/{names[0]}").status_code == 503
+    assert client.get("/projection").status_code == 503
+    response = client.post("/list-similar-cyclists", json={"cyclist": names[0]})
+    assert response.status_code == 200
+
+
+def test_startup_falls_back_to_cached_artifacts(tmp_path, monkeypatch):
+    generate_artifacts(str(tmp_path), n_riders=50, dtype="int8")
+    monkeypatch.delenv("LOCAL_ARTIFACTS_DIR", raising=False)
+    monkeypatch.setenv("S3_CACHE_DIR", str(tmp_path))
+    monkeypatch.setenv("AWS_ENDPOINT_URL", "http://127.0.0.1:9")  # nothing listens
+    monkeypatch.setenv("AWS_MAX_ATTEMPTS", "1")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+
+    api = import_api()
+    assert len(api.RIDERS) == 50
+
+
+def test_startup_rejects_corrupt_artifacts(tmp_path, monkeypatch):
+    generate_artifacts(str(tmp_path), n_riders=50, dtype="float32")
+    file_embeddings = tmp_path / "rider_embeddings.tensors"
+    body = bytearray(file_embeddings.read_bytes())
+    body[-1] ^= 0xFF
+    file_embeddings.write_bytes(body)
+    monkeypatch.setenv("LOCAL_ARTIFACTS_DIR", str(tmp_path))
+
+    with pytest.raises(ValueError, match="checksum"):
+        import_api()
@@ -1,4 +1,8 @@
+import io
+
 import pytest
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
 
 from src.aws import AWSManager
 
@@ -10,3 +14,49 @@ def test_s3_bucket_exists():
     buckets = aws_manager.list_s3_buckets()
 
     assert "cyclingsimilarity-s3" in buckets
+
+
+def add_get_object(stubber, body, etag, if_none_match=None):
+    expected = {"Bucket": "bucket", "Key": "key.txt"}
+    if if_none_match is not None:
+        expected["IfNoneMatch"] = if_none_match
+    stubber.add_response(
+        "get_object",
+        {
+            "Body": StreamingBody(io.BytesIO(body), len(body)),
+            "ETag": etag,
+            "ContentLength": len(body),
+        },
+        expected,
+    )
+
+
+def test_download_if_changed(tmp_path, monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    aws_manager = AWSManager()
+    file = str(tmp_path / "cache" / "key.txt")
+
+    with Stubber(aws_manager.s3) as stubber:
+        add_get_object(stubber, b"first", '"v1"')  # nothing cached yet
+        stubber.add_client_error(
+            "get_object",
+            service_error_code="NotModified",
+            http_status_code=304,
+            expected_params={
+                "Bucket": "bucket",
+                "Key": "key.txt",
+                "IfNoneMatch": '"v1"',
+            },
+        )
+        add_get_object(stubber, b"second", '"v2"', if_none_match='"v1"')
+
+        for expected in [b"first", b"first", b"second"]:
+            aws_manager.download_if_changed("bucket", "key.txt", file)
+            with open(file, "rb") as f:
+                assert f.read() == expected
+        stubber.assert_no_pending_responses()
+
+    with open(f"{file}.etag") as f:
+        assert f.read() == '"v2"'
+    counters = aws_manager.monitor.to_dict()["stages"]["other"]["counters"]
+    assert counters == {"s3_requests": 3, "s3_bytes": 11, "s3_cache_hits": 1}
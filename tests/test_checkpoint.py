@@ -0,0 +1,75 @@
+import os
+import shutil
+
+from botocore.exceptions import ClientError
+
+from src.checkpoint import Checkpoint
+
+
+class FakeAWSManager:
+    """Mirrors S3 keys as files in a local folder."""
+
+    def __init__(self, dir_bucket):
+        self.dir = dir_bucket
+
+    def store_data_from_file_to_s3(self, file, bucket, key):
+        os.makedirs(os.path.dirname(os.path.join(self.dir, key)), exist_ok=True)
+        shutil.copy(file, os.path.join(self.dir, key))
+
+    def load_file_from_s3(self, bucket, key, file):
+        if not os.path.exists(os.path.join(self.dir, key)):
+            raise ClientError({"Error": {"Code": "404"}}, "GetObject")
+        shutil.copy(os.path.join(self.dir, key), file)
+
+    def download_many_from_s3(self, files, bucket):
+        for key, file in files.items():
+            self.load_file_from_s3(bucket, key, file)
+
+
+def make_checkpoint(dir_checkpoint, aws_manager=None):
+    return Checkpoint(dir_checkpoint, aws_manager, bucket="bucket", prefix="ckpt")
+
+
+def test_checkpoint_restores_unfinished_runs(tmp_path):
+    checkpoint = make_checkpoint(tmp_path / "ckpt")
+    assert not checkpoint.restore()
+
+    checkpoint.reset(run_date="2023-10-01")
+    with open(checkpoint.path("units.txt"), "w") as f:
+        f.write("a\nb\n")
+    checkpoint.mark_done("phase_1", "units.txt")
+
+    checkpoint = make_checkpoint(tmp_path / "ckpt")
+    assert checkpoint.restore()
+    assert checkpoint.is_done("phase_1") and not checkpoint.is_done("phase_2")
+    assert checkpoint.read_units("units.txt") == {"a", "b"}
+    assert checkpoint.state["run_date"] == "2023-10-01"
+
+    checkpoint.finish()
+    assert not make_checkpoint(tmp_path / "ckpt").restore()
+
+    checkpoint.reset(run_date="2023-10-02")
+    assert not checkpoint.is_done("phase_1")
+    assert checkpoint.read_units("units.txt") == set()
+
+
+def test_checkpoint_restores_from_mirror(tmp_path):
+    aws_manager = FakeAWSManager(tmp_path / "bucket")
+    checkpoint = make_checkpoint(tmp_path / "machine_1", aws_manager)
+    checkpoint.reset(run_date="2023-10-01")
+    with open(checkpoint.path("units.txt"), "w") as f:
+        f.write("a\n")
+    checkpoint.mark_done("phase_1", "units.txt")
+
+    other = make_checkpoint(tmp_path / "machine_2", aws_manager)
+    assert other.restore()
+    assert other.is_done("phase_1") and other.read_units("units.txt") == {"a"}
+
+    # a new run overwrites the mirrored state right away
+    checkpoint.reset(run_date="2023-10-02")
+    other = make_checkpoint(tmp_path / "machine_3", aws_manager)
+    assert other.restore() and other.state["run_date"] == "2023-10-02"
+    assert not other.is_done("phase_1")
+
+    checkpoint.finish()
+    assert not make_checkpoint(tmp_path / "machine_4", aws_manager).restore()
@@ -0,0 +1,35 @@
+import numpy as np
+
+from src.clustering import build_archetypes, compute_pca_projection, minibatch_kmeans
+
+
+def test_minibatch_kmeans_finds_separated_clusters():
+    rng = np.random.default_rng(0)
+    centers = np.eye(4, 15) * 10
+    X = np.concatenate([c + rng.normal(size=(250, 15)) * 0.1 for c in centers])
+
+    _, labels, _ = minibatch_kmeans(X, n_clusters=4, batch_size=100)
+
+    # every true cluster maps onto exactly one found cluster
+    assert all(len(np.unique(labels[i * 250 : (i + 1) * 250])) == 1 for i in range(4))
+    assert len(np.unique(labels)) == 4
+
+
+def test_pca_projection_is_ordered_by_variance():
+    X = np.random.default_rng(0).normal(size=(500, 15)) * np.arange(15, 0, -1)
+
+    projection, explained = compute_pca_projection(X, n_components=3)
+
+    assert projection.shape == (500, 3)
+    assert np.all(np.diff(projection.var(axis=0)) < 0)
+    assert np.all(np.diff(explained) < 0)
+
+
+def test_build_archetypes_aligns_with_names():
+    factors = np.random.default_rng(0).normal(size=(100, 15))
+
+    archetypes = build_archetypes([f"R{i}" for i in range(100)], factors, 5)
+
+    assert archetypes["labels"].shape == archetypes["distances"].shape == (100,)
+    assert archetypes["projection"].shape == (100, 3)
+    assert archetypes["centroids"].shape == (5, 15)
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from src.embeddings import (
+    compute_cosine_similarity,
+    compute_row_norms,
+    compute_topk_overlap,
+    dequantize_factors,
+    quantize_factors,
+)
+
+FACTORS = np.random.default_rng(0).normal(size=(500, 15)).astype(np.float32)
+
+
+@pytest.mark.parametrize(
+    "dtype, atol", [("float32", 0), ("float16", 1e-2), ("int8", 5e-2)]
+)
+def test_quantize_factors_roundtrip(dtype, atol):
+    values, scales = quantize_factors(FACTORS, dtype)
+
+    assert values.dtype == np.dtype(dtype)
+    assert np.allclose(dequantize_factors(values, scales), FACTORS, atol=atol)
+
+
+def test_cosine_similarity_ignores_int8_scales():
+    values, scales = quantize_factors(FACTORS, "int8")
+    idx_popu = np.arange(1, 50)
+
+    simil_int8 = compute_cosine_similarity(
+        values, compute_row_norms(values), 0, idx_popu
+    )
+    simil_float32 = compute_cosine_similarity(
+        FACTORS, compute_row_norms(FACTORS), 0, idx_popu
+    )
+
+    assert np.allclose(simil_int8, simil_float32, atol=1e-2)
+
+
+def test_topk_overlap():
+    values, scales = quantize_factors(FACTORS, "float16")
+
+    assert compute_topk_overlap(FACTORS, FACTORS) == 1.0
+    assert compute_topk_overlap(FACTORS, dequantize_factors(values, scales)) > 0.95
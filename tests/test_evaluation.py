@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+from src.evaluation import (
+    compare_models,
+    compute_neighbour_stability,
+    compute_recall_at_k,
+    compute_rmse,
+    predict_ratings,
+)
+
+
+def make_model(n_riders=50, n_stages=20, n_factors=4, seed=0, normalize="bins"):
+    rng = np.random.default_rng(seed)
+    return {
+        "rider_names": np.array(["#na#"] + [f"R{i}" for i in range(n_riders)]),
+        "stage_names": np.array(["#na#"] + [f"S{i}" for i in range(n_stages)]),
+        "rider_factors": rng.normal(size=(n_riders + 1, n_factors)).astype("f4"),
+        "stage_factors": rng.normal(size=(n_stages + 1, n_factors)).astype("f4"),
+        "rider_bias": rng.normal(size=n_riders + 1).astype("f4"),
+        "stage_bias": rng.normal(size=n_stages + 1).astype("f4"),
+        "y_range": np.array([0, 5], dtype="f4"),
+        "normalize": normalize,
+    }
+
+
+def test_predict_ratings():
+    model = make_model()
+    preds = predict_ratings(model, ["R3", "R3", "unknown"], ["S1", "unknown", "S1"])
+
+    x = (
+        model["rider_factors"][4] @ model["stage_factors"][2]
+        + model["rider_bias"][4]
+        + model["stage_bias"][2]
+    )
+    assert np.isclose(preds[0], 5 / (1 + np.exp(-x)))
+    assert np.isnan(preds[1:]).all()
+
+
+def test_holdout_metrics_of_perfect_predictions():
+    model = make_model()
+    riders = [f"R{i}" for i in range(30)]
+    preds = predict_ratings(model, riders, ["S0"] * 30)
+    df_holdout = pd.DataFrame(
+        {
+            "rider": riders,
+            "stage": "S0",
+            "result": preds,
+            "rank": pd.Series(preds).rank(ascending=False).to_numpy(),
+        }
+    )
+
+    assert np.isclose(compute_rmse(model, df_holdout), 0, atol=1e-6)
+    assert compute_recall_at_k(model, df_holdout, k=10) == 1.0
+    assert compute_recall_at_k(model, df_holdout, k=5) == 0.5
+
+    model["normalize"] = "1-20"  # lower is better, so the top-10 is now missed
+    assert compute_recall_at_k(model, df_holdout, k=10) == 0.0
+
+
+def test_neighbour_stability():
+    model_a, model_b = make_model(seed=0), make_model(seed=1)
+    assert compute_neighbour_stability(model_a, model_a, n_workers=2, chunk_size=7) == 1
+    assert compute_neighbour_stability(model_a, model_b, k=10) < 0.5
+
+    # riders only known to one model are ignored, whatever their order
+    model_c = {**model_a}
+    order = np.r_[0, np.arange(len(model_a["rider_names"]) - 1, 0, -1)]
+    model_c["rider_names"] = np.append(model_a["rider_names"][order], "R_new")
+    model_c["rider_factors"] = np.vstack([model_a["rider_factors"][order], np.ones(4)])
+
+    report = compare_models(model_a, model_c, k=5)
+    assert report["n_common_riders"] == 50
+    assert report["neighbour_stability@5"] == 1
+
+
+def test_rmse_only_on_the_scale_of_the_holdout():
+    model_a, model_b = make_model(normalize="bins"), make_model(normalize="0-1")
+    df_holdout = pd.DataFrame(
+        {
+            "rider": ["R0", "R1", "R2"],
+            "stage": "S0",
+            "result": [5, 4, np.nan],  # not rated in bins mode
+            "rank": [1, 4, 250],
+            "normalize": "bins",
+        }
+    )
+
+    report = compare_models(model_a, model_b, df_holdout=df_holdout, k=2)
+    assert report["holdout_normalize"] == "bins"
+    assert np.isfinite(report["a"]["rmse"])
+    assert report["b"]["rmse"] is None
+    assert report["b"]["recall@2"] == compute_recall_at_k(model_b, df_holdout, k=2)
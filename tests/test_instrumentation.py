@@ -0,0 +1,36 @@
+import pytest
+
+from src.instrumentation import PipelineMonitor
+
+
+def test_monitor_attributes_counters_to_stages():
+    monitor = PipelineMonitor("test")
+
+    with monitor.stage("download"):
+        with monitor.request("s3"):
+            monitor.count("s3_bytes", 100)
+    with pytest.raises(ValueError):
+        with monitor.stage("parse"):
+            with monitor.request("pcs"):
+                raise ValueError
+
+    stages = monitor.to_dict()["stages"]
+    assert stages["download"]["status"] == "ok"
+    assert stages["download"]["counters"] == {"s3_requests": 1, "s3_bytes": 100}
+    assert stages["parse"]["status"] == "failed"
+    assert stages["parse"]["counters"] == {"pcs_requests": 1, "pcs_failures": 1}
+
+
+def test_monitor_records_memory_per_stage():
+    monitor = PipelineMonitor("test")
+
+    with monitor.stage("allocate"):
+        data = bytearray(50 * 1024**2)  # noqa: F841
+    with monitor.stage("idle"):
+        pass
+
+    stages = monitor.to_dict()["stages"]
+    if stages["allocate"]["rss_end_mb"] is not None:  # only on Linux
+        rss_used = stages["allocate"]["rss_end_mb"] - stages["allocate"]["rss_start_mb"]
+        assert rss_used > 40
+        assert stages["idle"]["peak_rss_increase_mb"] < 10
@@ -0,0 +1,15 @@
+from src.metrics import MetricsRegistry
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1))
+
+    for value in [0.05, 0.1, 0.5, 2]:
+        histogram.observe(value, endpoint="/")
+
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{endpoint="/",le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{endpoint="/",le="1"} 3' in lines
+    assert 'latency_seconds_bucket{endpoint="/",le="+Inf"} 4' in lines
+    assert 'latency_seconds_count{endpoint="/"} 4' in lines
@@ -0,0 +1,105 @@
+import json
+import struct
+
+import numpy as np
+import pytest
+import torch
+from fastai.collab import EmbeddingDotBias
+
+from src.evaluation import load_model, predict_ratings
+from src.model_format import (
+    deserialize_model,
+    read_model,
+    serialize_model,
+    write_model,
+)
+from tests.test_evaluation import make_model
+
+
+def make_tensors():
+    model = make_model(n_riders=10, n_stages=5, n_factors=3)
+    return {k: v for k, v in model.items() if isinstance(v, np.ndarray)}
+
+
+def test_serialize_model_roundtrip():
+    tensors = {**make_tensors(), "counts": np.arange(7, dtype=np.int64)}
+    body = serialize_model(tensors, {"normalize": "bins"})
+
+    loaded, metadata = deserialize_model(body)
+
+    assert metadata == {"normalize": "bins"}
+    assert loaded.keys() == tensors.keys()
+    for name, array in tensors.items():
+        assert loaded[name].dtype == array.dtype
+        assert np.array_equal(loaded[name], array)
+        assert not loaded[name].flags.writeable  # a view on the buffer, not a copy
+
+
+def pack(manifest):
+    header = json.dumps(manifest).encode("utf-8")
+    return struct.pack("<Q", len(header)) + header
+
+
+def test_deserialize_model_rejects_bad_files():
+    body = bytearray(serialize_model(make_tensors()))
+    body[-1] ^= 0xFF
+    with pytest.raises(ValueError, match="checksum"):
+        deserialize_model(bytes(body))
+
+    body = serialize_model({"x": np.zeros(4, dtype=np.float32)})
+    (n_header,) = struct.unpack("<Q", body[:8])
+    manifest = json.loads(body[8 : 8 + n_header])
+    data = bytes(16)
+    bad_manifests = {
+        "newer": {**manifest, "version": 99},
+        "no valid format version": {
+            k: v for k, v in manifest.items() if k != "version"
+        },
+        "no checksum": {k: v for k, v in manifest.items() if k != "sha256"},
+        "outside the data section": {
+            **manifest,
+            "tensors": {"x": {**manifest["tensors"]["x"], "offset": 8}},
+        },
+        "doesn't match its shape": {
+            **manifest,
+            "tensors": {"x": {**manifest["tensors"]["x"], "shape": [400]}},
+        },
+        "entry of x is invalid": {
+            **manifest,
+            "tensors": {"x": {**manifest["tensors"]["x"], "dtype": "|O"}},
+        },
+    }
+    for match, bad_manifest in bad_manifests.items():
+        with pytest.raises(ValueError, match=match):
+            deserialize_model(pack(bad_manifest) + data, verify=False)
+
+    for body in [b"", b"1234", struct.pack("<Q", 1000) + b"{}", pack([]) + data]:
+        with pytest.raises(ValueError, match="Not a model file"):
+            deserialize_model(body)
+
+
+def test_read_model_from_file(tmp_path):
+    tensors = make_tensors()
+    metadata = {"normalize": "bins", "y_range": [0.0, 5.0]}
+    write_model(tmp_path / "model.tensors", tensors, metadata)
+
+    loaded, _ = read_model(tmp_path / "model.tensors")
+    assert np.array_equal(loaded["rider_names"], tensors["rider_names"])
+
+    # a PyTorch model with the stored weights predicts like the vectorized evaluation
+    model = EmbeddingDotBias(3, 11, 6, y_range=metadata["y_range"])
+    for layer, name in [
+        (model.u_weight, "rider_factors"),
+        (model.i_weight, "stage_factors"),
+        (model.u_bias, "rider_bias"),
+        (model.i_bias, "stage_bias"),
+    ]:
+        weight = torch.from_numpy(loaded[name].copy())  # views are read-only
+        layer.weight.data = weight.reshape(layer.weight.shape)
+    x = torch.tensor([[1, 2], [4, 1], [10, 5]])
+    expected = predict_ratings(
+        load_model(tmp_path / "model.tensors"),
+        tensors["rider_names"][x[:, 0]],
+        tensors["stage_names"][x[:, 1]],
+    )
+    assert np.allclose(model(x).detach().numpy(), expected, atol=1e-5)
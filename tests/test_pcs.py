@@ -1,7 +1,13 @@
 import pytest
 from procyclingstats import Race
 
-from src.utils import convert_name_to_slug, try_to_parse
+from src.instrumentation import PipelineMonitor
+from src.utils import (
+    convert_name_to_slug,
+    convert_names_to_slugs,
+    fetch_scraper,
+    try_to_parse,
+)
 
 
 @pytest.mark.parametrize(
@@ -22,3 +28,33 @@ def test_try_to_parse(test_input, expected):
 )
 def test_conversion_name_to_slug(test_input, expected):
     assert convert_name_to_slug(test_input) == expected
+
+
+def test_conversion_names_to_slugs():
+    names = ["VAN AERT Wout", "AYUSO Juan", "VAN AERT Wout"]
+
+    assert convert_names_to_slugs(names).tolist() == [
+        convert_name_to_slug(name) for name in names
+    ]
+
+
+def test_fetch_scraper_counts_bytes_sent(monkeypatch):
+    class Response:
+        text = (
+            '<div class="page-title"><div class="main"><h1>Tour</h1></div></div>'
+            '<div class="page-content"><div>Overview</div></div>'
+        )
+        content = text.encode("utf-8")
+        headers = {"Content-Length": "30"}  # compressed
+
+    urls = []
+    monkeypatch.setattr(
+        "src.utils.requests.get", lambda url: urls.append(url) or Response()
+    )
+    monitor = PipelineMonitor("test")
+
+    scraper = fetch_scraper(Race, "race/tour-de-france/2022/overview", monitor)
+
+    assert urls == ["https://www.procyclingstats.com/race/tour-de-france/2022/overview"]
+    assert scraper.html.css_first("h1").text() == "Tour"
+    assert monitor.to_dict()["stages"]["other"]["counters"] == {"pcs_bytes": 30}
@@ -0,0 +1,20 @@
+import time
+
+from src.profiler import SamplingProfiler
+
+
+def spin_for_profiler(duration_s):
+    deadline = time.perf_counter() + duration_s
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+
+
+def test_profiler_samples_busy_function():
+    profiler = SamplingProfiler()
+    profiler.start(interval=0.001)
+    spin_for_profiler(0.2)
+    collapsed = profiler.stop()
+
+    assert not profiler.running
+    assert profiler.n_samples > 0
+    assert "test_profiler.py:spin_for_profiler" in collapsed
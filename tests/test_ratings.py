@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+from src.ratings import HOLDOUT_FILE, prepare_ratings
+from src.utils import get_result_weights
+
+
+def test_prepare_ratings_in_chunks(tmp_path):
+    df_results = pd.DataFrame(
+        {"A a": [1, 2, np.nan], "B b": [2, np.nan, 1], "C c": [np.nan, 1, np.nan]},
+        index=pd.MultiIndex.from_tuples(
+            [
+                ("2023", "race-x/2023/result", "1.UWT"),
+                ("2023", "race-y/2023/gc", "2.Pro"),
+                ("2022", "race-y/2022/stage-1/result", "2.1"),
+            ],
+            names=["year", "stage_slug", "class"],
+        ),
+    )
+    df_results.to_csv(tmp_path / "results.csv")
+
+    ratings = prepare_ratings(
+        tmp_path / "results.csv",
+        tmp_path / "ratings",
+        n_participations=2,
+        normalize="1-20",
+        curr_year=2023,
+        chunksize=1,
+    )
+
+    riders, stages = ratings.classes["rider"], ratings.classes["stage"]
+    weights = get_result_weights(df_results.index.to_frame(index=False), 2023)
+    expected = {
+        (rider, stage[1]): df_results.loc[stage, rider] * w
+        for stage, w in zip(df_results.index, weights)
+        for rider in ["A a", "B b"]
+        if not np.isnan(df_results.loc[stage, rider])
+    }
+    actual = {
+        (riders[r], stages[s]): v
+        for r, s, v in zip(ratings.rider, ratings.stage, ratings.result)
+    }
+
+    assert list(riders) == ["#na#", "A a", "B b"]  # C c has too few results
+    assert actual.keys() == expected.keys()
+    assert np.allclose([actual[k] for k in expected], list(expected.values()))
+
+
+def test_prepare_ratings_holds_out_recent_results(tmp_path):
+    df_results = pd.DataFrame(
+        {"A a": [1, 2, 3], "B b": [2, 1, 1]},
+        index=pd.MultiIndex.from_tuples(
+            [
+                ("2023", "race-x/2023/result", "1.UWT"),
+                ("2023", "race-y/2023/result", "1.UWT"),
+                ("2022", "race-x/2022/result", "1.UWT"),
+            ],
+            names=["year", "stage_slug", "class"],
+        ),
+    )
+    df_results.to_csv(tmp_path / "results.csv")
+
+    ratings = prepare_ratings(
+        tmp_path / "results.csv",
+        tmp_path / "ratings",
+        n_participations=1,
+        normalize="bins",
+        curr_year=2023,
+        holdout_frac=1.0,
+    )
+    df_holdout = pd.read_csv(tmp_path / "ratings" / HOLDOUT_FILE)
+
+    stages = ratings.classes["stage"]
+    assert {stages[s] for s in ratings.stage} == {"race-x/2022/result"}
+    assert len(df_holdout) == 4 and set(df_holdout["rank"]) == {1, 2}
+    assert len(ratings) + len(df_holdout) == df_results.count().sum()
+
+
+def test_holdout_does_not_depend_on_normalize_mode(tmp_path):
+    rng = np.random.default_rng(0)
+    ranks = rng.permutation(np.arange(1, 301).reshape(1, -1).repeat(6, 0), axis=1)
+    df_results = pd.DataFrame(
+        ranks.astype(float),
+        columns=[f"R{i} r" for i in range(300)],
+        index=pd.MultiIndex.from_tuples(
+            [(str(2020 + i // 2), f"race-{i}/result", "1.UWT") for i in range(6)],
+            names=["year", "stage_slug", "class"],
+        ),
+    )
+    df_results.to_csv(tmp_path / "results.csv")
+
+    holdouts = {}
+    for normalize in ["0-1", "bins"]:
+        prepare_ratings(
+            tmp_path / "results.csv",
+            tmp_path / normalize,
+            n_participations=1,
+            normalize=normalize,
+            curr_year=2023,
+            chunksize=2,
+            holdout_frac=0.3,
+        )
+        holdouts[normalize] = pd.read_csv(tmp_path / normalize / HOLDOUT_FILE)
+
+    keys = ["rider", "stage", "rank"]
+    assert holdouts["0-1"][keys].equals(holdouts["bins"][keys])
+    assert (holdouts["bins"]["normalize"] == "bins").all()
+    assert holdouts["bins"].loc[holdouts["bins"]["rank"] > 200, "result"].isna().all()
@@ -0,0 +1,129 @@
+import io
+import os.path as path
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.append(path.join(path.dirname(path.dirname(__file__)), "scripts"))
+
+import scrape
+
+from src.instrumentation import PipelineMonitor
+
+DF_RACES = pd.DataFrame(
+    {"race": ["B"], "name": ["b"], "class": ["2.UWT"], "slug": ["b-race"]}
+)
+
+
+class FakeAWSManager:
+    stored = {}  # uploads of the last run
+
+    def __init__(self, monitor=None):
+        pass
+
+    def load_csv_as_pandas_from_s3(self, bucket, key):
+        return DF_RACES
+
+    def store_many_to_s3(self, bodies, bucket):
+        FakeAWSManager.stored.update(bodies)
+
+    def store_data_from_string_to_s3(self, string, bucket, key):
+        pass
+
+
+class FakePCS:
+    """Parses races with three stages, and can fail after a number of stages."""
+
+    def __init__(self, fail_after=None, riders_failing=()):
+        self.fail_after = fail_after
+        self.riders_failing = riders_failing
+        self.stages_parsed = []
+        self.riders_parsed = []
+
+    def parse_rider_info(self, rider_slug, monitor=None):
+        self.riders_parsed.append(rider_slug)
+        if rider_slug in self.riders_failing:
+            return (None, None)
+        return ("BE", "1995-01-01")
+
+    def try_to_parse(self, obj, slug, printit=False, monitor=None):
+        year = slug.split("/")[2]
+        if obj is scrape.Race:
+            return {
+                "enddate": f"{year}-05-01",
+                "is_one_day_race": False,
+                "stages": [
+                    {"stage_url": f"race/b-race/{year}/stage-{i}"} for i in (1, 2, 3)
+                ],
+            }
+        if len(self.stages_parsed) == self.fail_after:
+            raise ConnectionError("network blip")
+        self.stages_parsed.append(slug)
+        results = [{"rider_name": f"R{j} X", "rank": j} for j in range(1, 4)]
+        return {"results": results, "gc": results}
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    monkeypatch.setattr(scrape, "DIR_WORK", str(tmp_path))
+    monkeypatch.setattr(scrape, "DIR_CHECKPOINT", str(tmp_path / "checkpoint"))
+    monkeypatch.setattr(scrape, "RUN_DATE", "2023-10-01")
+    monkeypatch.setattr(scrape, "AWSManager", FakeAWSManager)
+    FakeAWSManager.stored = {}
+
+    def run(pcs, resume=False):
+        monkeypatch.setattr(scrape, "try_to_parse", pcs.try_to_parse)
+        monkeypatch.setattr(scrape, "parse_rider_info", pcs.parse_rider_info)
+        scrape.scrape(
+            2, PipelineMonitor("test"), resume=resume, checkpoint_every=1, mirror=False
+        )
+
+    return run
+
+
+def test_scrape_resumes_halfway_through_stage_results(pipeline):
+    with pytest.raises(ConnectionError):
+        pipeline(FakePCS(fail_after=3))  # 8 stages, including gc, over 2 years
+
+    pcs = FakePCS()
+    pipeline(pcs, resume=True)
+    assert len(pcs.stages_parsed) == 5  # only the stages left
+
+    df_results = pd.read_csv(io.BytesIO(FakeAWSManager.stored["df_race_results.csv"]))
+    assert len(df_results) == 8
+    assert list(df_results.columns[3:]) == ["R1 X", "R2 X", "R3 X"]
+
+
+def test_scrape_does_not_resume_finished_runs(pipeline):
+    pipeline(FakePCS())
+
+    pcs = FakePCS()
+    pipeline(pcs, resume=True)
+    assert len(pcs.stages_parsed) == 8  # a new run from scratch
+
+
+def test_scrape_fetches_failed_riders_again(pipeline):
+    pipeline(FakePCS(riders_failing=["r2-x"]))
+    df_riders = pd.read_csv(io.BytesIO(FakeAWSManager.stored["df_riders_data.csv"]))
+    assert df_riders["rider_name"].tolist() == ["R1 X", "R3 X"]
+
+    pcs = FakePCS()
+    pipeline(pcs)
+    assert pcs.riders_parsed == ["r2-x"]  # the others are in the registry
+    df_riders = pd.read_csv(io.BytesIO(FakeAWSManager.stored["df_riders_data.csv"]))
+    assert df_riders["rider_name"].tolist() == ["R1 X", "R2 X", "R3 X"]
+
+
+def test_scrape_race_overview_leaves_out_one_day_races(monkeypatch):
+    overview = {"enddate": "2023-04-09", "is_one_day_race": True, "stages": []}
+    monkeypatch.setattr(scrape, "try_to_parse", lambda *args, **kwargs: overview)
+    assert scrape.scrape_race_overview("a-race", 2023, "2023-10-01", None) == []
+
+    overview.update(
+        is_one_day_race=False, stages=[{"stage_url": "race/b-race/2023/stage-1"}]
+    )
+    assert scrape.scrape_race_overview("b-race", 2023, "2023-10-01", None) == [
+        "race/b-race/2023/gc",
+        "race/b-race/2023/stage-1/result",
+    ]